@@ -17,6 +17,7 @@ from genki_anki_deck_generator.config import (
     set_config_path,
     set_decks_path,
 )
+from genki_anki_deck_generator.utils.profiling import profile, span
 
 
 def main() -> None:
@@ -48,6 +49,23 @@ def main() -> None:
         default=f"{DECKS_PATH}",
         help=f"Path to the decks directory (default: {DECKS_PATH})",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a summary of the time spent in each pipeline phase",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        type=Path,
+        default=None,
+        help="Write the recorded phases to this file as a Chrome trace (implies --profile)",
+    )
+    parser.add_argument(
+        "--profile-stats",
+        type=Path,
+        default=None,
+        help="Run cProfile and write its stats to this .pstats file (implies --profile)",
+    )
 
     subparsers = parser.add_subparsers(dest="subcommand")
     for command_name in commands:
@@ -58,12 +76,18 @@ def main() -> None:
     set_config_path(Path(args.config))
     set_decks_path(Path(args.decks))
 
-    if command := commands.get(args.subcommand):
-        command.run(args)
-    else:
-        download.run(args)
-        process_audio.run(args)
-        generate.run(args)
+    enable_profile = bool(args.profile or args.profile_trace or args.profile_stats)
+    with profile(enable_profile, trace_path=args.profile_trace, stats_path=args.profile_stats):
+        if command := commands.get(args.subcommand):
+            with span(args.subcommand):
+                command.run(args)
+        else:
+            with span("download"):
+                download.run(args)
+            with span("process-audio"):
+                process_audio.run(args)
+            with span("generate"):
+                generate.run(args)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 import argparse
+from pathlib import Path
 
 from genki_anki_deck_generator.template import load_templates
-from genki_anki_deck_generator.utils.duplicates import remove_duplicates
+from genki_anki_deck_generator.utils.duplicates import remove_duplicates, write_duplicate_report
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -11,9 +12,25 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Automatically remove duplicates",
     )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Only match identical words, without normalizing kana, character width and spaces",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=None,
+        help="Write the duplicates found as a JSON report to this file",
+    )
 
 
 def run(args: argparse.Namespace) -> None:
     print("Checking decks for duplicate vocabulary words...")
     templates_by_deck = load_templates()
-    remove_duplicates(templates_by_deck, save=args.remove, echo=True)
+    duplicates = remove_duplicates(
+        templates_by_deck, save=args.remove, echo=True, normalize=not args.exact
+    )
+    if args.report:
+        write_duplicate_report(templates_by_deck, duplicates, args.report)
+        print(f"Wrote duplicate report to {args.report}")
@@ -1,18 +1,51 @@
 import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from itertools import repeat
 from pathlib import Path, PurePosixPath
+from typing import Any
 
 import genanki
 import minify_html
 
-from genki_anki_deck_generator.config import get_config
+from genki_anki_deck_generator import config as config_module
+from genki_anki_deck_generator.config import (
+    CACHE_DIR,
+    get_config,
+    set_config_path,
+    set_decks_path,
+)
 from genki_anki_deck_generator.template import Card, Template, load_templates
+from genki_anki_deck_generator.utils.anki_package import (
+    merge_packages,
+    update_package,
+    write_package,
+)
+from genki_anki_deck_generator.utils.cache import DiskCache
 from genki_anki_deck_generator.utils.conjugations import (
     get_conjugation_display_names,
     get_conjugation_links,
     get_conjugations,
+    get_conjugations_batch,
 )
 from genki_anki_deck_generator.utils.duplicates import remove_duplicates
-from genki_anki_deck_generator.utils.jinja import render_template
+from genki_anki_deck_generator.utils.jinja import (
+    get_templates_digest,
+    render_template,
+    render_templates,
+)
+from genki_anki_deck_generator.utils.media import (
+    MEDIA_CACHE_DIR,
+    get_transcoded_name,
+    is_transcoding_available,
+    transcode_media_files,
+)
+from genki_anki_deck_generator.utils.profiling import span
 
 HTML_SOUND = """
 {{#sound}}
@@ -21,22 +54,128 @@ HTML_SOUND = """
 {{/sound}}
 """
 
+PACKAGE_PATH = Path("genki.apkg")
+RENDER_CACHE_PATH = CACHE_DIR / "render.sqlite3"
+RENDER_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+CARD_SIDES = (
+    Path("japanese_question.html"),
+    Path("japanese_answer.html"),
+    Path("english_question.html"),
+    Path("english_answer.html"),
+)
+
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
     parser.description = "Generate Anki decks from templates."
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes used to parse templates and render cards "
+            "(default: 1, 0 uses all CPU cores)"
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Re-parse every template and re-render every card instead of using {CACHE_DIR}",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"Patch the notes and media of the previous {PACKAGE_PATH} instead of rebuilding it",
+    )
+    parser.add_argument(
+        "--split-decks",
+        action="store_true",
+        help="Write a separate package for each deck (e.g. genki_1.apkg), building decks in parallel",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help=f"With --split-decks, also merge the deck packages into {PACKAGE_PATH}",
+    )
+    parser.add_argument(
+        "--transcode",
+        action="store_true",
+        help=(
+            "Trim, loudness-normalize and re-encode all card audio to compact mp3s before "
+            f"packaging, caching the results in {MEDIA_CACHE_DIR} (requires ffmpeg)"
+        ),
+    )
+
+
+@dataclass(kw_only=True)
+class PendingNote:
+    anki_deck: genanki.Deck
+    deck: str
+    template: Template
+    card: Card
+    card_index: int
+    template_card_index: int
+    qualified_sound_file_path: Path | None
+    context: dict[str, Any]
 
 
 def run(args: argparse.Namespace) -> None:
     print("Generating Anki decks...")
+    jobs = getattr(args, "jobs", 1) or os.cpu_count() or 1
+    use_cache = not getattr(args, "no_cache", False)
+    incremental = getattr(args, "incremental", False)
+    transcode = getattr(args, "transcode", False)
+    if transcode and not is_transcoding_available():
+        print("Error: ffmpeg is required to transcode audio, install it or run without --transcode")
+        sys.exit(1)
     config = get_config()
-    templates_by_deck = load_templates()
+    templates_by_deck = load_templates(use_cache, jobs)
 
     if config.dedupe:
         remove_duplicates(templates_by_deck, echo=True)
 
+    if getattr(args, "split_decks", False):
+        deck_package_paths = write_deck_packages(
+            templates_by_deck, jobs, use_cache, incremental, transcode
+        )
+        if getattr(args, "merge", False):
+            print(f"Merging deck packages into {PACKAGE_PATH}...")
+            merge_packages(deck_package_paths, PACKAGE_PATH)
+        return
+
+    anki_decks, media_files = build_decks(templates_by_deck, jobs, use_cache, transcode)
+
+    # Generate an Anki package with all book decks
+    if incremental:
+        update_package(anki_decks, media_files, PACKAGE_PATH)
+    else:
+        write_package(anki_decks, media_files, PACKAGE_PATH)
+
+
+@span("build_decks")
+def build_decks(
+    templates_by_deck: dict[str, list[Template]],
+    jobs: int,
+    use_cache: bool,
+    transcode: bool = False,
+) -> tuple[list[genanki.Deck], dict[str, Path]]:
+    """
+    Build the Anki decks for the given templates, along with the media files they need.
+    With `transcode`, the audio files are replaced by their transcoded versions.
+    """
+    config = get_config()
     model = get_anki_model()
     anki_decks = []
+    pending_notes: list[PendingNote] = []
     media_files: dict[str, Path] = {}
+    # Conjugate all verbs up front, so that each distinct verb is only conjugated once
+    get_conjugations_batch(
+        card
+        for templates in templates_by_deck.values()
+        for template in templates
+        for card in template.iter_cards()
+    )
     for deck, templates in templates_by_deck.items():
         anki_deck = genanki.Deck(
             config.deck_ids[deck],
@@ -50,30 +189,108 @@ def run(args: argparse.Namespace) -> None:
                 qualified_sound_file_path: Path | None = (
                     Path("sources/audio") / card.sound_file if card.sound_file else None
                 )
-                note = GenkiNote(
-                    model=model,
-                    deck=deck,
-                    template=template,
-                    card=card,
-                    card_index=card_index,
-                    template_card_index=template_card_index,
-                    qualified_sound_file_path=qualified_sound_file_path,
+                pending_notes.append(
+                    PendingNote(
+                        anki_deck=anki_deck,
+                        deck=deck,
+                        template=template,
+                        card=card,
+                        card_index=card_index,
+                        template_card_index=template_card_index,
+                        qualified_sound_file_path=qualified_sound_file_path,
+                        context=get_render_context(card),
+                    )
                 )
-                anki_deck.add_note(note)
 
                 if qualified_sound_file_path:
                     add_media_file(media_files, qualified_sound_file_path)
 
                 card_index += 1
 
-    # Generate an Anki package with all book decks
-    anki_package = genanki.Package(anki_decks)
+    with (
+        DiskCache(RENDER_CACHE_PATH, max_size=RENDER_CACHE_MAX_SIZE) if use_cache else nullcontext()
+    ) as render_cache:
+        rendered_sides = render_all_card_sides(pending_notes, jobs, render_cache)
+        if render_cache:
+            print(f"Render cache: {render_cache.hits} hits, {render_cache.misses} misses")
+    for pending_note, sides in zip(pending_notes, rendered_sides, strict=True):
+        pending_note.anki_deck.add_note(
+            GenkiNote(
+                model=model,
+                deck=pending_note.deck,
+                template=pending_note.template,
+                card=pending_note.card,
+                card_index=pending_note.card_index,
+                template_card_index=pending_note.template_card_index,
+                qualified_sound_file_path=pending_note.qualified_sound_file_path,
+                rendered_sides=sides,
+                transcode=transcode,
+            )
+        )
 
     # Add font file
     add_media_file(media_files, config.download_dir / "fonts" / "_NotoSansCJKjp-Regular.woff2")
 
-    anki_package.media_files = media_files.values()
-    anki_package.write_to_file("genki.apkg")
+    if transcode:
+        media_files = transcode_media_files(media_files, jobs)
+    return anki_decks, media_files
+
+
+def write_deck_packages(
+    templates_by_deck: dict[str, list[Template]],
+    jobs: int,
+    use_cache: bool,
+    incremental: bool,
+    transcode: bool = False,
+) -> list[Path]:
+    """Write one package per deck, building up to `jobs` decks in parallel."""
+    if jobs <= 1 or len(templates_by_deck) < 2:
+        return [
+            write_deck_package(deck, templates, use_cache, incremental, transcode)
+            for deck, templates in templates_by_deck.items()
+        ]
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(templates_by_deck)),
+        initializer=_init_worker,
+        initargs=(config_module.CONFIG_PATH, config_module.DECKS_PATH),
+    ) as executor:
+        return list(
+            executor.map(
+                write_deck_package,
+                templates_by_deck.keys(),
+                templates_by_deck.values(),
+                repeat(use_cache),
+                repeat(incremental),
+                repeat(transcode),
+            )
+        )
+
+
+@span("write_deck_package")
+def write_deck_package(
+    deck: str,
+    templates: list[Template],
+    use_cache: bool,
+    incremental: bool,
+    transcode: bool = False,
+) -> Path:
+    path = Path(f"{deck}.apkg")
+    anki_decks, media_files = build_decks(
+        {deck: templates}, jobs=1, use_cache=use_cache, transcode=transcode
+    )
+    if incremental:
+        update_package(anki_decks, media_files, path)
+    else:
+        write_package(anki_decks, media_files, path)
+    print(f"Wrote {path}")
+    return path
+
+
+def _init_worker(config_path: Path, decks_path: Path) -> None:
+    # Workers may be spawned rather than forked, so restore the paths set on the command line
+    set_config_path(config_path)
+    set_decks_path(decks_path)
 
 
 class GenkiNote(genanki.Note):  # type: ignore
@@ -86,6 +303,8 @@ class GenkiNote(genanki.Note):  # type: ignore
         card_index: int,
         template_card_index: int,
         qualified_sound_file_path: Path | None,
+        rendered_sides: list[str],
+        transcode: bool = False,
     ) -> None:
         self.card = card
         simple_kanji_meanings = (
@@ -94,24 +313,15 @@ class GenkiNote(genanki.Note):  # type: ignore
             else {}
         )
         sort_id = f"{deck}::{template.path}::{template_card_index:03d}"
+        sound_name = (
+            PurePosixPath(qualified_sound_file_path).name if qualified_sound_file_path else None
+        )
+        if sound_name and transcode:
+            sound_name = get_transcoded_name(sound_name)
         guid = genanki.guid_for(
             "genki_anki_deck_generator", deck, str(template.path), card.japanese
         )
 
-        context = card.to_dict()
-        context["kanji_ruby_data"] = (
-            get_kanji_ruby_data(
-                card.kanji,
-                card.kanji_readings if card.kanji_readings else [(card.kanji, card.japanese)],
-            )
-            if card.kanji
-            else None
-        )
-        context["kanji_meanings"] = card.kanji_meanings if card.kanji_meanings else {}
-        context["conjugations"] = get_conjugations(card)
-        context["conjugation_display_names"] = get_conjugation_display_names()
-        context["conjugation_links"] = get_conjugation_links()
-        context["jpdb_link"] = f"https://jpdb.io/search?q={card.kanji or card.japanese}"
         super().__init__(
             model=model,
             fields=[
@@ -120,29 +330,8 @@ class GenkiNote(genanki.Note):  # type: ignore
                 card.kanji if card.kanji else "",
                 card.english,
                 ", ".join(simple_kanji_meanings),
-                f"[sound:{PurePosixPath(qualified_sound_file_path).name}]"
-                if qualified_sound_file_path
-                else "",
-                minify_html.minify(
-                    render_template(Path("japanese_question.html"), context),
-                    keep_closing_tags=True,
-                    minify_js=False,
-                ),
-                minify_html.minify(
-                    render_template(Path("japanese_answer.html"), context),
-                    keep_closing_tags=True,
-                    minify_js=False,
-                ),
-                minify_html.minify(
-                    render_template(Path("english_question.html"), context),
-                    keep_closing_tags=True,
-                    minify_js=False,
-                ),
-                minify_html.minify(
-                    render_template(Path("english_answer.html"), context),
-                    keep_closing_tags=True,
-                    minify_js=False,
-                ),
+                f"[sound:{sound_name}]" if sound_name else "",
+                *rendered_sides,
                 sort_id,
             ],
             tags=[tag.replace(" ", "_") for tag in card.tags],
@@ -151,6 +340,132 @@ class GenkiNote(genanki.Note):  # type: ignore
         )
 
 
+@span("build_render_context")
+def get_render_context(card: Card) -> dict[str, Any]:
+    """Build the Jinja context used to render the sides of a card."""
+    context = card.to_dict()
+    context["kanji_ruby_data"] = (
+        get_kanji_ruby_data(
+            card.kanji,
+            card.kanji_readings if card.kanji_readings else [(card.kanji, card.japanese)],
+        )
+        if card.kanji
+        else None
+    )
+    context["kanji_meanings"] = card.kanji_meanings if card.kanji_meanings else {}
+    context["conjugations"] = get_conjugations(card)
+    context["conjugation_display_names"] = get_conjugation_display_names()
+    context["conjugation_links"] = get_conjugation_links()
+    context["jpdb_link"] = f"https://jpdb.io/search?q={card.kanji or card.japanese}"
+    return context
+
+
+class HtmlMinifier:
+    """
+    Minify HTML fragments, minifying each unique fragment only once per minifier. With --jobs,
+    every worker process has its own minifier, so a fragment may be minified once per worker.
+    """
+
+    def __init__(self) -> None:
+        self._minified: dict[bytes, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def minify(self, html: str) -> str:
+        key = hashlib.blake2b(html.encode(), digest_size=16).digest()
+        if (minified := self._minified.get(key)) is not None:
+            self.hits += 1
+            return minified
+
+        self.misses += 1
+        minified = minify_html.minify(html, keep_closing_tags=True, minify_js=False)
+        self._minified[key] = minified
+        return minified
+
+
+# One minifier per process, shared by every card rendered in that process
+MINIFIER = HtmlMinifier()
+
+
+def render_card_sides(context: dict[str, Any]) -> list[str]:
+    """Render and minify the question and answer sides of a card."""
+    with span("render_jinja"):
+        sides = render_templates(CARD_SIDES, context)
+    with span("minify_html"):
+        return [MINIFIER.minify(side) for side in sides]
+
+
+def render_card_sides_batch(contexts: list[dict[str, Any]]) -> tuple[list[list[str]], int, int]:
+    """
+    Render the sides of a batch of cards.
+    Returns the rendered sides along with the number of minifier hits and misses in this batch.
+    """
+    hits, misses = MINIFIER.hits, MINIFIER.misses
+    rendered_sides = [render_card_sides(context) for context in contexts]
+    return rendered_sides, MINIFIER.hits - hits, MINIFIER.misses - misses
+
+
+@span("render_cards")
+def render_all_card_sides(
+    pending_notes: list[PendingNote], jobs: int, cache: DiskCache | None = None
+) -> list[list[str]]:
+    """
+    Render the sides of every card, optionally spreading the work across a process pool.
+    Cards found in `cache` are not rendered again. Results are returned in the same order as
+    `pending_notes`.
+    """
+    rendered_sides: list[list[str] | None] = [None] * len(pending_notes)
+    cache_keys = [get_render_cache_key(note) for note in pending_notes] if cache else []
+    if cache:
+        for i, key in enumerate(cache_keys):
+            if (cached := cache.get(key)) is not None:
+                rendered_sides[i] = json.loads(cached)
+
+    to_render = [i for i, sides in enumerate(rendered_sides) if sides is None]
+    contexts = [pending_notes[i].context for i in to_render]
+    if jobs <= 1 or len(contexts) < 2:
+        batches = [render_card_sides_batch(contexts)]
+    else:
+        batch_size = max(1, len(contexts) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            batches = list(
+                executor.map(
+                    render_card_sides_batch,
+                    [contexts[i : i + batch_size] for i in range(0, len(contexts), batch_size)],
+                )
+            )
+
+    results = [sides for batch, _, _ in batches for sides in batch]
+    minify_hits = sum(hits for _, hits, _ in batches)
+    minify_total = minify_hits + sum(misses for _, _, misses in batches)
+    if minify_total:
+        print(
+            f"Minified {minify_total - minify_hits} HTML fragments out of {minify_total}, "
+            f"reusing the others ({minify_hits / minify_total:.1%} per-process hit rate)"
+        )
+
+    for i, sides in zip(to_render, results, strict=True):
+        rendered_sides[i] = sides
+        if cache:
+            cache.set(cache_keys[i], json.dumps(sides, ensure_ascii=False).encode())
+
+    return [sides for sides in rendered_sides if sides is not None]
+
+
+def get_render_cache_key(pending_note: PendingNote) -> str:
+    """
+    Hash everything that can affect the rendered sides of a card: its render context (which
+    includes the card itself, its kanji meanings and its conjugations), its tags and the
+    contents of the templates directory.
+    """
+    key_data = json.dumps(
+        [get_templates_digest(), pending_note.context, pending_note.card.tags],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(key_data.encode()).hexdigest()
+
+
 def get_kanji_ruby_data(kanji: str, kanji_readings: list[tuple[str, str]]) -> list[tuple[str, str]]:
     i = 0
     j = 0
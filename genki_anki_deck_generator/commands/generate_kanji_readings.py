@@ -4,7 +4,8 @@ import sys
 import jaconv
 from fugashi import Tagger  # type: ignore
 
-from genki_anki_deck_generator.template import Card, load_templates, save_template
+from genki_anki_deck_generator.template import Card, load_templates, save_dirty_templates
+from genki_anki_deck_generator.utils.profiling import span
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -25,24 +26,28 @@ def run(args: argparse.Namespace) -> None:
         return
     print(f"Found {len(cards_with_missing_readings)} cards with missing readings.")
 
-    for card in cards_with_missing_readings:
-        assert card.kanji is not None, "Card must have Kanji to generate readings"
-        card.kanji_readings = generate_kanji_readings(card.kanji)
-        if not card.kanji_readings:
-            print(f"Warning: No readings generated for {card.kanji}. Please check the Kanji.")
-            continue
-        print(card.kanji, card.kanji_readings)
-
-        generated_reading = card.kanji
-        for kanji, reading in card.kanji_readings:
-            generated_reading = generated_reading.replace(kanji, reading, 1)
-        if card.japanese != generated_reading:
-            print(
-                f"Warning: generated reading {generated_reading} does not match original reading: {card.kanji} ({card.japanese})",
-            )
-            correct_readings(card.kanji_readings)
-
-        save_template(card.template)
+    with save_dirty_templates(templates_by_deck):
+        for card in cards_with_missing_readings:
+            assert card.kanji is not None, "Card must have Kanji to generate readings"
+            kanji_readings = generate_kanji_readings(card.kanji)
+            if not kanji_readings:
+                print(f"Warning: No readings generated for {card.kanji}. Please check the Kanji.")
+                continue
+            print(card.kanji, kanji_readings)
+
+            generated_reading = card.kanji
+            for kanji, reading in kanji_readings:
+                generated_reading = generated_reading.replace(kanji, reading, 1)
+            if card.japanese != generated_reading:
+                print(
+                    f"Warning: generated reading {generated_reading} does not match original reading: {card.kanji} ({card.japanese})",
+                )
+                correct_readings(kanji_readings)
+
+            # Only modify the card once the readings are corrected, so that readings left
+            # uncorrected on exit are not saved
+            card.kanji_readings = kanji_readings
+            card.template.mark_dirty()
 
 
 def correct_readings(readings: list[tuple[str, str]]) -> None:
@@ -56,6 +61,7 @@ def correct_readings(readings: list[tuple[str, str]]) -> None:
             readings[i] = (kanji, corrected_reading)
 
 
+@span("generate_kanji_readings")
 def generate_kanji_readings(kanji: str) -> list[tuple[str, str]]:
     """Generate readings for the given Kanji string."""
     tagger = Tagger()
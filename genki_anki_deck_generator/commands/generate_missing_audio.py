@@ -3,7 +3,7 @@ from hashlib import md5
 from pathlib import Path
 
 from genki_anki_deck_generator.config import get_config
-from genki_anki_deck_generator.template import Card, load_templates, save_template
+from genki_anki_deck_generator.template import Card, load_templates, save_dirty_templates
 from genki_anki_deck_generator.utils.voicepeak import voicepeak_tts
 from genki_anki_deck_generator.utils.voicevox import voicevox_tts
 
@@ -37,40 +37,41 @@ def run(args: argparse.Namespace) -> None:
         return
     print(f"Found {len(cards_with_missing_audio)} cards with missing audio files.")
 
-    for card in cards_with_missing_audio:
-        sanitized_japanese = (
-            card.japanese.replace(" ", "_")
-            .replace("/", "_")
-            .replace("\\", "_")
-            .replace(":", "")
-            .replace("?", "")
-            .replace("*", "")
-        )
-        output_path = (
-            config.download_dir
-            / "audio"
-            / "tts"
-            / f"{sanitized_japanese}_{_card_hash(card)[:5]}.wav"
-        )
-        if not output_path.exists():
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            japanese = f"{card.kanji} ({card.japanese})" if card.kanji else card.japanese
-            print(f"Generating audio for card: {japanese} - {card.english}")
-            text = card.kanji if card.kanji else card.japanese
-            if card.tts_override:
-                print(f"Using TTS override text: {card.tts_override.text}")
-                text = card.tts_override.text
-            _do_tts(
-                text=text,
-                args=args,
-                output_path=output_path,
+    with save_dirty_templates(templates_by_deck):
+        for card in cards_with_missing_audio:
+            sanitized_japanese = (
+                card.japanese.replace(" ", "_")
+                .replace("/", "_")
+                .replace("\\", "_")
+                .replace(":", "")
+                .replace("?", "")
+                .replace("*", "")
             )
-            print(f"Audio saved to {output_path}")
-        else:
-            print(f"Skipping TTS generation, audio file already exists: {output_path}")
+            output_path = (
+                config.download_dir
+                / "audio"
+                / "tts"
+                / f"{sanitized_japanese}_{_card_hash(card)[:5]}.wav"
+            )
+            if not output_path.exists():
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                japanese = f"{card.kanji} ({card.japanese})" if card.kanji else card.japanese
+                print(f"Generating audio for card: {japanese} - {card.english}")
+                text = card.kanji if card.kanji else card.japanese
+                if card.tts_override:
+                    print(f"Using TTS override text: {card.tts_override.text}")
+                    text = card.tts_override.text
+                _do_tts(
+                    text=text,
+                    args=args,
+                    output_path=output_path,
+                )
+                print(f"Audio saved to {output_path}")
+            else:
+                print(f"Skipping TTS generation, audio file already exists: {output_path}")
 
-        card.sound_file = str(output_path.relative_to(config.download_dir).as_posix())
-        save_template(card.template)
+            card.sound_file = str(output_path.relative_to(config.download_dir).as_posix())
+            card.template.mark_dirty()
 
 
 def _do_tts(text: str, args: argparse.Namespace, output_path: Path) -> None:
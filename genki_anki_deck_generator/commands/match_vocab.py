@@ -6,7 +6,7 @@ from pathlib import Path, PurePosixPath
 
 import pykakasi
 
-from genki_anki_deck_generator.template import Card, load_templates, save_template
+from genki_anki_deck_generator.template import Card, Template, iter_templates, save_template
 
 PROGRESS_FILE = Path("match_vocab_progress.json")
 
@@ -60,22 +60,13 @@ def run(args: argparse.Namespace) -> None:
     enable_sound = args.sound
     enable_progress = args.progress
 
-    templates_by_deck = load_templates()
-    if args.template:
-        template_path = args.template
-        delete = []
-        for deck, templates in templates_by_deck.items():
-            templates = [t for t in templates if t.path == template_path]
-            templates_by_deck[deck] = templates
-            if not templates:
-                delete.append(deck)
-
-        for deck in delete:
-            del templates_by_deck[deck]
-
-        if not any(templates_by_deck.values()):
-            print(f"Error: Template file {template_path} not found in any deck.")
-            return
+    # Only the templates matching --template are parsed
+    templates_by_deck: dict[str, list[Template]] = {}
+    for deck, template in iter_templates(paths=[args.template] if args.template else None):
+        templates_by_deck.setdefault(deck, []).append(template)
+    if args.template and not templates_by_deck:
+        print(f"Error: Template file {args.template} not found in any deck.")
+        return
 
     if PROGRESS_FILE.exists():
         with PROGRESS_FILE.open("r", encoding="utf-8") as f:
@@ -135,8 +126,7 @@ def run(args: argparse.Namespace) -> None:
 
                     return
 
-            with open(template.path, "w", encoding="utf-8") as f:
-                save_template(template)
+            save_template(template)
 
             progress["completed"].append(str(template.path))
             if enable_progress:
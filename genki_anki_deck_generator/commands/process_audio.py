@@ -1,9 +1,34 @@
 import argparse
+import hashlib
+import json
+import os
 import shutil
 import sys
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
 
-from genki_anki_deck_generator.config import get_config, get_deck_config
-from genki_anki_deck_generator.utils.sound import split_audio_file
+from genki_anki_deck_generator.config import (
+    DeckAudioFile,
+    DeckAudioFileOverride,
+    get_config,
+    get_deck_config,
+)
+from genki_anki_deck_generator.utils.sound import PCM_CACHE_DIR, get_file_digest, split_audio_file
+
+MANIFEST_PATH = Path("process_audio_manifest.json")
+# Bump whenever changes to the splitting code change the segments written for the same inputs
+SPLIT_VERSION = 1
+
+
+@dataclass(kw_only=True)
+class SplitJob:
+    sound_file: Path
+    target_dir: Path
+    silence_threshold: int
+    overrides: dict[int, DeckAudioFileOverride]
+    fingerprint: str
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -12,15 +37,33 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         "--reprocess",
         "-r",
         action="store_true",
-        help="Reprocess audio files even if the target directory already exists and is not empty.",
+        help="Reprocess all audio files, even those whose file, silence threshold and overrides did not change.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Decode every audio file instead of reusing decoded audio from {PCM_CACHE_DIR}",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of audio files split in parallel (default: 1, 0 uses all CPU cores)",
     )
 
 
 def run(args: argparse.Namespace) -> None:
     print("Processing audio files...")
     reprocess = getattr(args, "reprocess", False)
+    jobs = getattr(args, "jobs", 1) or os.cpu_count() or 1
+    use_cache = not getattr(args, "no_cache", False)
     config = get_config()
-    to_process = []
+    manifest_path = config.download_dir / MANIFEST_PATH
+    previous_manifest = _load_manifest(manifest_path)
+    # Sources no longer in any audio.yaml are dropped from the manifest
+    manifest: dict[str, Any] = {}
+    to_process: list[SplitJob] = []
     for deck_name in config.decks:
         deck_config = get_deck_config(deck_name)
         audio_dir = config.download_dir / "audio" / deck_name
@@ -31,33 +74,122 @@ def run(args: argparse.Namespace) -> None:
                 sys.exit(1)
 
             target_dir = sound_file.parent / sound_file.stem
-            if target_dir.is_dir() and any(target_dir.iterdir()):
-                if reprocess:
-                    shutil.rmtree(target_dir, ignore_errors=True)
-                else:
-                    print(f"Skipping {sound_file}, target directory exists and is not empty.")
-                    continue
-
-            overrides = audio_file.overrides or {}
+            fingerprint = _get_fingerprint(sound_file, audio_file)
+            entry = previous_manifest.get(sound_file.as_posix())
+            if not reprocess and entry and _is_up_to_date(entry, target_dir, fingerprint):
+                print(f"Skipping {sound_file}, file, silence threshold and overrides unchanged.")
+                manifest[sound_file.as_posix()] = entry
+                continue
+
             to_process.append(
-                (
-                    sound_file,
-                    target_dir,
-                    audio_file.sound_silence_threshold,
-                    overrides,
+                SplitJob(
+                    sound_file=sound_file,
+                    target_dir=target_dir,
+                    silence_threshold=audio_file.sound_silence_threshold,
+                    overrides=audio_file.overrides or {},
+                    fingerprint=fingerprint,
                 )
             )
 
-    for sound_file, target_dir, silence_threshold, overrides in to_process:
-        print(f"Processing audio file: {sound_file} -> {target_dir}")
+    _save_manifest(manifest, manifest_path)
+    if jobs > 1 and len(to_process) > 1:
+        _split_audio_files_in_parallel(to_process, jobs, use_cache, manifest, manifest_path)
+        return
+
+    for job in to_process:
+        print(f"Processing audio file: {job.sound_file} -> {job.target_dir}")
         try:
-            split_audio_file(
-                file=sound_file,
-                target_dir=target_dir,
-                sound_silence_threshold=silence_threshold,
-                overrides=overrides,
-            )
+            segment_names = _split_job(job, use_cache)
         except KeyboardInterrupt:
             print("Interrupted! Deleting partially processed directory")
-            shutil.rmtree(target_dir, ignore_errors=True)
+            shutil.rmtree(job.target_dir, ignore_errors=True)
             raise
+        _record_split(manifest, manifest_path, job, segment_names)
+
+
+def _split_audio_files_in_parallel(
+    to_process: list[SplitJob],
+    jobs: int,
+    use_cache: bool,
+    manifest: dict[str, Any],
+    manifest_path: Path,
+) -> None:
+    executor = ProcessPoolExecutor(max_workers=min(jobs, len(to_process)))
+    split_jobs: dict[Future[list[str]], SplitJob] = {}
+    completed: set[Path] = set()
+    try:
+        for job in to_process:
+            print(f"Processing audio file: {job.sound_file} -> {job.target_dir}")
+            future = executor.submit(_split_job, job, use_cache)
+            split_jobs[future] = job
+
+        for future in as_completed(split_jobs):
+            job = split_jobs[future]
+            _record_split(manifest, manifest_path, job, future.result())
+            completed.add(job.target_dir)
+    except KeyboardInterrupt:
+        # Wait for the files being split to stop before deleting them
+        executor.shutdown(wait=True, cancel_futures=True)
+        print("Interrupted! Deleting partially processed directories")
+        for future, job in split_jobs.items():
+            # Cancelled jobs never started, so their previous segments are still intact
+            if job.target_dir not in completed and not future.cancelled():
+                shutil.rmtree(job.target_dir, ignore_errors=True)
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _split_job(job: SplitJob, use_cache: bool) -> list[str]:
+    # Remove the segments split from previous inputs, which may not all be overwritten. This is
+    # only done once the file is being split, so that an interrupted run keeps the segments of
+    # the files it did not get to.
+    shutil.rmtree(job.target_dir, ignore_errors=True)
+    return split_audio_file(
+        file=job.sound_file,
+        target_dir=job.target_dir,
+        sound_silence_threshold=job.silence_threshold,
+        overrides=job.overrides,
+        use_cache=use_cache,
+    )
+
+
+def _get_fingerprint(sound_file: Path, audio_file: DeckAudioFile) -> str:
+    """Fingerprint of everything the segments of an audio file depend on."""
+    inputs = {
+        "version": SPLIT_VERSION,
+        "file": get_file_digest(sound_file),
+        "silence_threshold": audio_file.sound_silence_threshold,
+        "overrides": {str(i): asdict(o) for i, o in (audio_file.overrides or {}).items()},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _is_up_to_date(entry: dict[str, Any], target_dir: Path, fingerprint: str) -> bool:
+    return entry["fingerprint"] == fingerprint and all(
+        (target_dir / segment_name).exists() for segment_name in entry["segments"]
+    )
+
+
+def _record_split(
+    manifest: dict[str, Any], manifest_path: Path, job: SplitJob, segment_names: list[str]
+) -> None:
+    # Saved after every file, so that an interrupted run keeps the files already split
+    manifest[job.sound_file.as_posix()] = {
+        "fingerprint": job.fingerprint,
+        "segments": segment_names,
+    }
+    _save_manifest(manifest, manifest_path)
+
+
+def _load_manifest(path: Path) -> dict[str, Any]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))  # type: ignore[no-any-return]
+
+
+def _save_manifest(manifest: dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(path)
@@ -7,6 +7,7 @@ import yaml
 
 CONFIG_PATH = Path("config/config.toml")
 DECKS_PATH = Path("config/decks")
+CACHE_DIR = Path(".cache")
 
 
 @dataclass(kw_only=True)
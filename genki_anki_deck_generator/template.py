@@ -1,14 +1,38 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import hashlib
+import pickle
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
 from enum import StrEnum
+from functools import cache
 from pathlib import Path, PurePosixPath
-from typing import Any, Generator
+from typing import Any, Generator, Iterable
 
-from yaml import safe_dump, safe_load
+from yaml import dump, load
 
-from genki_anki_deck_generator.config import get_config, get_deck_config
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeDumper, SafeLoader  # type: ignore[assignment]
+
+from genki_anki_deck_generator.config import CACHE_DIR, get_config, get_deck_config
+from genki_anki_deck_generator.utils.cache import DiskCache
 from genki_anki_deck_generator.utils.kanji_meanings import get_kanji_meanings
+from genki_anki_deck_generator.utils.profiling import span
+
+TEMPLATE_CACHE_PATH = CACHE_DIR / "templates.sqlite3"
+TEMPLATE_CACHE_MAX_SIZE = 256 * 1024 * 1024
+# Bump whenever the Template, CardCollection or Card classes change in a way their fields do not
+# show, to invalidate cached trees. Changes to their fields invalidate them automatically.
+TEMPLATE_CACHE_VERSION = 3
+
+# Tag tuples shared by every card with the same tags
+_TAGS: dict[tuple[str, ...], tuple[str, ...]] = {}
 
 
 class VerbGroup(StrEnum):
@@ -17,12 +41,12 @@ class VerbGroup(StrEnum):
     IRREGULAR = "irregular"
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class TTSOverride:
     text: str
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Card:
     template: Template
     japanese: str
@@ -34,30 +58,15 @@ class Card:
     sound_file: str | None = None
     tts_override: TTSOverride | None = None
     parent: CardCollection | None = None
-
-    def __post_init__(self) -> None:
-        self._kanji_meanings: dict[str, list[str] | None] | None = None
-
-    @property
-    def tags(self) -> list[str]:
-        parent = self.parent
-        tags: list[str] = []
-        while parent:
-            tags[:0] = parent.tags
-            parent = parent.parent
-        return tags
+    # Tags of the card and all its parent collections, computed when the template is loaded
+    tags: tuple[str, ...] = ()
 
     @property
     def kanji_meanings(self) -> dict[str, list[str] | None] | None:
         """Get the meanings of the kanji in this card."""
         if not self.kanji:
             return None
-        if self._kanji_meanings is not None:
-            return self._kanji_meanings
-
-        kanjis = [k for k in self.kanji if k != "."]
-        self._kanji_meanings = {k: get_kanji_meanings(k) for k in kanjis}
-        return self._kanji_meanings
+        return _get_kanji_meanings(self.kanji)
 
     def __str__(self) -> str:
         return f"Card(japanese={self.japanese}, english={self.english}, kanji={self.kanji}, sound_file={self.sound_file}, tags={self.tags})"
@@ -82,7 +91,7 @@ class Card:
         return d
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class CardCollection:
     tags: list[str] = field(default_factory=list)
     vocabulary: list[Card | CardCollection] = field(default_factory=list)
@@ -96,28 +105,41 @@ class CardCollection:
 
     def remove_card(self, card: Card) -> None:
         """Remove a card from the collection."""
-        if not self._remove_card(card):
-            raise ValueError(f"Card {card.japanese} not found in collection")
-
-    def _remove_card(self, card: Card) -> bool:
-        """Recursively remove a card from the collection."""
-        for i in range(len(self.vocabulary) - 1, -1, -1):
-            item = self.vocabulary[i]
-            if item == card:
-                del self.vocabulary[i]
-                return True
-            elif isinstance(item, CardCollection):
-                if item._remove_card(card):
-                    if not item.vocabulary:
-                        self.vocabulary.remove(item)
-                    return True
-        return False
-
-
-@dataclass(kw_only=True)
+        self.remove_cards([card])
+
+    def remove_cards(self, cards: Iterable[Card]) -> None:
+        """
+        Remove cards from the collection in a single pass, along with the nested collections
+        left empty. Cards are matched by identity.
+        """
+        to_remove = {id(card): card for card in cards}
+        self._remove_cards(to_remove)
+        if to_remove:
+            missing = next(iter(to_remove.values()))
+            raise ValueError(f"Card {missing.japanese} not found in collection")
+
+    def _remove_cards(self, to_remove: dict[int, Card]) -> None:
+        """Recursively remove the cards in `to_remove`, popping each card once removed."""
+        vocabulary = []
+        for item in self.vocabulary:
+            if to_remove:
+                if isinstance(item, CardCollection):
+                    if item.vocabulary:
+                        item._remove_cards(to_remove)
+                        if not item.vocabulary:
+                            continue
+                elif to_remove.pop(id(item), None) is not None:
+                    continue
+            vocabulary.append(item)
+        self.vocabulary = vocabulary
+
+
+@dataclass(kw_only=True, slots=True)
 class Template:
     path: Path
     cards: CardCollection
+    # Whether the cards were modified since the template was loaded or saved
+    dirty: bool = False
 
     def to_dict(self) -> dict[str, Any]:
         return {
@@ -139,33 +161,207 @@ class Template:
         """Remove a card from the template."""
         self.cards.remove_card(card)
 
+    def remove_cards(self, cards: Iterable[Card]) -> None:
+        """Remove cards from the template in a single pass."""
+        self.cards.remove_cards(cards)
+
+    def mark_dirty(self) -> None:
+        """Mark the template as modified, so that it is saved by `save_dirty_templates`."""
+        self.dirty = True
+
 
-def load_templates() -> dict[str, list[Template]]:
+@span("load_templates")
+def load_templates(use_cache: bool = True, jobs: int = 1) -> dict[str, list[Template]]:
+    """
+    Load the templates of every deck, sorted by path.
+    Unless `use_cache` is False, parsed templates are cached by path and content, so that
+    unchanged templates are not parsed again. Templates which are not cached are parsed by `jobs`
+    worker processes.
+    """
     config = get_config()
+    template_paths = {deck: get_deck_config(deck).templates for deck in config.decks}
+    cache = DiskCache(TEMPLATE_CACHE_PATH, max_size=TEMPLATE_CACHE_MAX_SIZE) if use_cache else None
+    try:
+        loaded_templates = iter(
+            _load_template_files(
+                [path for paths in template_paths.values() for path in paths], cache, jobs
+            )
+        )
+    finally:
+        if cache:
+            cache.close()
+
     templates: dict[str, list[Template]] = {}
-    for deck in config.decks:
-        templates[deck] = []
-        deck_config = get_deck_config(deck)
-        for template_path in deck_config.templates:
-            template_content = template_path.read_text(encoding="utf-8")
-            template_yaml = safe_load(template_content)
-            template = Template(path=template_path, cards=CardCollection())
-            cards = _load_cards(template, template_yaml)
-            assert isinstance(cards, CardCollection), "Template must contain a CardCollection"
-            template.cards = cards
-            templates[deck].append(template)
-
-    for deck_templates in templates.values():
-        deck_templates.sort(key=lambda x: x.path)
+    for deck, paths in template_paths.items():
+        templates[deck] = [next(loaded_templates) for _ in paths]
+        templates[deck].sort(key=lambda x: x.path)
 
     return templates
 
 
-def _load_cards(template: Template, template_yaml: dict[str, Any]) -> CardCollection | Card:
+def _load_template_files(
+    template_paths: list[Path], cache: DiskCache | None, jobs: int
+) -> list[Template]:
+    """Load the given template files in order, only parsing those which are not cached."""
+    templates: list[Template | None] = [None] * len(template_paths)
+    contents = [template_path.read_bytes() for template_path in template_paths]
+    cache_keys = [
+        _get_template_cache_key(template_path, content)
+        for template_path, content in zip(template_paths, contents, strict=True)
+    ]
+    to_parse = []
+    for i, (template_path, cache_key) in enumerate(zip(template_paths, cache_keys, strict=True)):
+        if cache and (template := _get_cached_template(cache, cache_key, template_path)):
+            templates[i] = template
+        else:
+            to_parse.append(i)
+
+    parse_args = ([template_paths[i] for i in to_parse], [contents[i] for i in to_parse])
+    if jobs > 1 and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(to_parse))) as executor:
+            parsed = list(
+                executor.map(
+                    parse_template, *parse_args, chunksize=max(1, len(to_parse) // (jobs * 4))
+                )
+            )
+        # Tags unpickled from workers are copies, intern them like cached templates
+        for template in parsed:
+            _intern_template_tags(template)
+    else:
+        parsed = list(map(parse_template, *parse_args))
+
+    for i, template in zip(to_parse, parsed, strict=True):
+        templates[i] = template
+        if cache:
+            cache.set(cache_keys[i], pickle.dumps(template, protocol=pickle.HIGHEST_PROTOCOL))
+
+    return [template for template in templates if template is not None]
+
+
+def iter_templates(
+    *,
+    decks: Iterable[str] | None = None,
+    paths: Iterable[Path] | None = None,
+    path_glob: str | None = None,
+    tags: Iterable[str] | None = None,
+    lessons: Iterable[int] | None = None,
+    use_cache: bool = True,
+) -> Generator[tuple[str, Template], None, None]:
+    """
+    Lazily load the templates matching every given filter, as (deck, template) pairs sorted by
+    deck and path. Templates are filtered by path before being read, and only the files that may
+    contain one of `tags` are parsed.
+    - `decks`: names of the decks to load
+    - `paths`: exact paths of the templates to load
+    - `path_glob`: glob pattern matched against the template path, e.g. "genki_1/L0*/*.yaml"
+    - `tags`: tags which at least one card of the template must have
+    - `lessons`: lesson numbers, taken from the Lxx directory the template is in
+    """
+    config = get_config()
+    deck_filter = set(decks) if decks is not None else None
+    path_filter = set(paths) if paths is not None else None
+    tag_filter = set(tags) if tags is not None else None
+    lesson_filter = set(lessons) if lessons is not None else None
+    cache = DiskCache(TEMPLATE_CACHE_PATH, max_size=TEMPLATE_CACHE_MAX_SIZE) if use_cache else None
+    try:
+        for deck in config.decks:
+            if deck_filter is not None and deck not in deck_filter:
+                continue
+            for template_path in sorted(get_deck_config(deck).templates):
+                if path_filter is not None and template_path not in path_filter:
+                    continue
+                if path_glob and not template_path.match(path_glob):
+                    continue
+                if lesson_filter is not None and _get_lesson(template_path) not in lesson_filter:
+                    continue
+                content = template_path.read_bytes()
+                if tag_filter is not None and not any(
+                    tag.encode("utf-8") in content for tag in tag_filter
+                ):
+                    continue
+
+                cache_key = _get_template_cache_key(template_path, content)
+                template = _get_cached_template(cache, cache_key, template_path) if cache else None
+                if not template:
+                    template = parse_template(template_path, content)
+                    if cache:
+                        cache.set(
+                            cache_key, pickle.dumps(template, protocol=pickle.HIGHEST_PROTOCOL)
+                        )
+                if tag_filter is not None and not any(
+                    tag_filter.intersection(card.tags) for card in template.iter_cards()
+                ):
+                    continue
+                yield deck, template
+    finally:
+        if cache:
+            cache.close()
+
+
+def _get_lesson(template_path: Path) -> int | None:
+    for part in reversed(template_path.parent.parts):
+        if match := re.fullmatch(r"L(\d+)", part):
+            return int(match.group(1))
+    return None
+
+
+def _get_template_cache_key(template_path: Path, template_content: bytes) -> str:
+    digest = hashlib.sha256(template_content).hexdigest()
+    return f"{TEMPLATE_CACHE_VERSION}:{_get_layout_digest()}:{template_path.resolve()}:{digest}"
+
+
+@cache
+def _get_layout_digest() -> str:
+    """Digest of the fields of the pickled classes, so that changing them invalidates the cache."""
+    layout = [
+        [cls.__name__, [(f.name, str(f.type)) for f in fields(cls)]]
+        for cls in (Template, CardCollection, Card, TTSOverride)
+    ]
+    layout.append([VerbGroup.__name__, [member.value for member in VerbGroup]])
+    return hashlib.sha256(repr(layout).encode()).hexdigest()[:16]
+
+
+def _get_cached_template(cache: DiskCache, cache_key: str, template_path: Path) -> Template | None:
+    cached = cache.get(cache_key)
+    if cached is None:
+        return None
+
+    try:
+        template: Template = pickle.loads(cached)
+        template.path = template_path
+        _intern_template_tags(template)
+    except (pickle.UnpicklingError, AttributeError, TypeError, ValueError, EOFError, ImportError):
+        # Pickled with classes that have changed since, parse the template again instead
+        return None
+    return template
+
+
+def _intern_template_tags(template: Template) -> None:
+    for card in template.iter_cards():
+        card.tags = _intern_tags(card.tags)
+
+
+def parse_template(template_path: Path, template_content: bytes) -> Template:
+    with span("parse_yaml"):
+        template_yaml = load(template_content, Loader=SafeLoader)
+    template = Template(path=template_path, cards=CardCollection())
+    cards = _load_cards(template, template_yaml, ())
+    assert isinstance(cards, CardCollection), "Template must contain a CardCollection"
+    template.cards = cards
+    return template
+
+
+def _load_cards(
+    template: Template, template_yaml: dict[str, Any], parent_tags: tuple[str, ...]
+) -> CardCollection | Card:
     if "vocabulary" in template_yaml:
+        tags = template_yaml.get("tags", [])
+        card_tags = _intern_tags(parent_tags + tuple(tags))
         collection = CardCollection(
-            tags=template_yaml.get("tags", []),
-            vocabulary=[_load_cards(template, card) for card in template_yaml["vocabulary"]],
+            tags=tags,
+            vocabulary=[
+                _load_cards(template, card, card_tags) for card in template_yaml["vocabulary"]
+            ],
         )
         for card in collection.vocabulary:
             card.parent = collection
@@ -173,12 +369,12 @@ def _load_cards(template: Template, template_yaml: dict[str, Any]) -> CardCollec
     if "japanese" in template_yaml:
         return Card(
             template=template,
-            japanese=template_yaml["japanese"],
+            japanese=sys.intern(template_yaml["japanese"]),
             japanese_note=template_yaml.get("japanese_note"),
             english=template_yaml["english"],
-            kanji=template_yaml.get("kanji"),
+            kanji=sys.intern(template_yaml["kanji"]) if template_yaml.get("kanji") else None,
             kanji_readings=[
-                (k, r)
+                (sys.intern(k), sys.intern(r))
                 for reading in template_yaml.get("kanji_readings", {})
                 for k, r in reading.items()
             ]
@@ -191,12 +387,57 @@ def _load_cards(template: Template, template_yaml: dict[str, Any]) -> CardCollec
             tts_override=TTSOverride(**template_yaml["tts_override"])
             if "tts_override" in template_yaml
             else None,
+            tags=parent_tags,
         )
 
     raise ValueError("Invalid template structure")
 
 
+def _intern_tags(tags: tuple[str, ...]) -> tuple[str, ...]:
+    return _TAGS.setdefault(tags, tuple(sys.intern(tag) for tag in tags))
+
+
+@cache
+def _get_kanji_meanings(kanji: str) -> dict[str, list[str] | None]:
+    """Get the meanings of each kanji in a word, shared by all cards with that word."""
+    return {k: get_kanji_meanings(k) for k in kanji if k != "."}
+
+
+@span("save_template")
 def save_template(template: Template) -> None:
-    with template.path.open("w", encoding="utf-8") as f:
-        content = template.cards.to_dict()
-        f.write(safe_dump(content, allow_unicode=True, default_flow_style=False, sort_keys=False))
+    """
+    Save a template to its YAML file.
+    The file is written next to the template and renamed over it, so that it is never left
+    partially written.
+    """
+    content = dump(
+        template.cards.to_dict(),
+        Dumper=SafeDumper,
+        allow_unicode=True,
+        default_flow_style=False,
+        sort_keys=False,
+    )
+    tmp_path = template.path.with_name(f"{template.path.name}.tmp")
+    try:
+        tmp_path.write_text(content, encoding="utf-8")
+        tmp_path.replace(template.path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    template.dirty = False
+
+
+@contextmanager
+def save_dirty_templates(
+    templates_by_deck: dict[str, list[Template]],
+) -> Generator[None, None, None]:
+    """
+    Save every template marked dirty once the body exits, even if it is interrupted, so that
+    templates modified many times are only written once.
+    """
+    try:
+        yield
+    finally:
+        for templates in templates_by_deck.values():
+            for template in templates:
+                if template.dirty:
+                    save_template(template)
@@ -0,0 +1,390 @@
+import itertools
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import genanki
+
+from genki_anki_deck_generator.utils.profiling import span
+
+COLLECTION_NAME = "collection.anki2"
+MEDIA_NAME = "media"
+
+# Media formats which are already compressed and are stored in the package as they are
+COMPRESSED_MEDIA_SUFFIXES = {".mp3", ".ogg", ".opus", ".m4a", ".woff", ".woff2", ".jpg", ".png"}
+COPY_BUFFER_SIZE = 1024 * 1024
+# Replaced or removed media stay in incrementally updated packages, which are rebuilt once these
+# unreferenced media files make up more than this fraction of the media bytes
+MAX_UNREFERENCED_MEDIA_RATIO = 0.25
+# Private zipfile.ZipFile attributes which `_drop_members_from` rewrites
+ZIPFILE_INTERNALS = ("filelist", "NameToInfo", "start_dir")
+
+
+@span("write_package")
+def write_package(decks: list[genanki.Deck], media_files: dict[str, Path], path: Path) -> None:
+    """
+    Write an Anki package containing the given decks and media files.
+    Unlike `genanki.Package.write_to_file`, media files are written before the collection, which
+    allows `update_package` to patch the package later without rewriting the media.
+    """
+    timestamp = time.time()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        collection_path = Path(tmp_dir) / COLLECTION_NAME
+        with span("write_collection"):
+            conn = sqlite3.connect(collection_path)
+            genanki.Package(decks).write_to_db(
+                conn.cursor(), timestamp, itertools.count(int(timestamp * 1000))
+            )
+            conn.commit()
+            conn.close()
+
+        with span("write_zip"), zipfile.ZipFile(path, "w") as package:
+            media_json = {}
+            for idx, (name, file) in enumerate(media_files.items()):
+                _write_media_file(package, file, str(idx))
+                media_json[str(idx)] = name
+            _write_collection(package, media_json, collection_path)
+
+
+@span("update_package")
+def update_package(decks: list[genanki.Deck], media_files: dict[str, Path], path: Path) -> None:
+    """
+    Patch an Anki package previously written by `write_package`.
+    Notes are matched by GUID, and only new, changed and deleted notes are written to the
+    collection. Media files already in the package are kept as they are, and only new or modified
+    media files are appended. Falls back to a full rebuild if there is no usable previous package.
+    """
+    if not path.exists():
+        print(f"No previous package found at {path}, writing a new one...")
+        write_package(decks, media_files, path)
+        return
+
+    timestamp = time.time()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with zipfile.ZipFile(path, "r") as package:
+            infos = {info.filename: info for info in package.infolist()}
+            tail_offset = _get_tail_offset(infos)
+            can_drop_members = all(hasattr(package, name) for name in ZIPFILE_INTERNALS)
+            if tail_offset is not None:
+                previous_media: dict[str, str] = json.loads(package.read(MEDIA_NAME))
+                collection_path = Path(package.extract(COLLECTION_NAME, tmp_dir))
+
+        if tail_offset is None:
+            print(f"Package {path} was not written incrementally, rebuilding it...")
+            write_package(decks, media_files, path)
+            return
+        if not can_drop_members:
+            print("This version of the zipfile module cannot patch packages, rebuilding...")
+            write_package(decks, media_files, path)
+            return
+
+        with span("diff_media"):
+            media_json, new_media = _diff_media(infos, previous_media, media_files)
+        unreferenced_size, media_size = _get_unreferenced_media_size(infos, media_json, new_media)
+        if unreferenced_size > MAX_UNREFERENCED_MEDIA_RATIO * media_size:
+            print(
+                f"{unreferenced_size / 1024**2:.1f} MB of replaced or removed media in {path}, "
+                "rebuilding it..."
+            )
+            write_package(decks, media_files, path)
+            return
+
+        with span("update_collection"):
+            conn = sqlite3.connect(collection_path)
+            inserted, updated, deleted = _update_collection(conn.cursor(), decks, timestamp)
+            conn.commit()
+            conn.close()
+
+        with span("write_zip"), zipfile.ZipFile(path, "a") as package:
+            _drop_members_from(package, tail_offset)
+            for idx, file in new_media:
+                _write_media_file(package, file, idx)
+            _write_collection(package, media_json, collection_path)
+
+    print(
+        f"Updated {path}: {inserted} notes added, {updated} notes updated, {deleted} notes "
+        f"removed, {len(new_media)} media files added"
+    )
+
+
+@span("merge_packages")
+def merge_packages(paths: list[Path], path: Path) -> None:
+    """
+    Merge packages written by `write_package` into a single package.
+    Note and card IDs of later packages are shifted past those of earlier ones, and media files
+    are copied over as they are, keeping the first file for each media name.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        collection_path = Path(tmp_dir) / COLLECTION_NAME
+        media_json: dict[str, str] = {}
+        with zipfile.ZipFile(path, "w") as package:
+            for i, source_path in enumerate(paths):
+                with zipfile.ZipFile(source_path, "r") as source:
+                    source_collection_path = Path(
+                        source.extract(COLLECTION_NAME, Path(tmp_dir) / str(i))
+                    )
+                    if i == 0:
+                        shutil.copyfile(source_collection_path, collection_path)
+                    else:
+                        _merge_collection(collection_path, source_collection_path)
+
+                    media_names = set(media_json.values())
+                    for idx, name in json.loads(source.read(MEDIA_NAME)).items():
+                        if name in media_names:
+                            continue
+                        new_idx = str(len(media_json))
+                        _copy_member(source, idx, package, new_idx)
+                        media_json[new_idx] = name
+                        media_names.add(name)
+
+            _write_collection(package, media_json, collection_path)
+
+
+def _write_collection(
+    package: zipfile.ZipFile, media_json: dict[str, str], collection_path: Path
+) -> None:
+    """Write the media index and the collection, which must be the last members of the package."""
+    package.writestr(MEDIA_NAME, json.dumps(media_json), compress_type=zipfile.ZIP_DEFLATED)
+    package.write(collection_path, COLLECTION_NAME, compress_type=zipfile.ZIP_DEFLATED)
+
+
+def _write_media_file(package: zipfile.ZipFile, file: Path, idx: str) -> None:
+    """
+    Stream a media file into the package. Already compressed formats are stored without
+    recompression, anything else (e.g. WAV) is deflated.
+    """
+    info = zipfile.ZipInfo.from_file(file, idx)
+    if file.suffix.lower() in COMPRESSED_MEDIA_SUFFIXES:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    with file.open("rb") as src, package.open(info, "w") as dest:
+        shutil.copyfileobj(src, dest, COPY_BUFFER_SIZE)
+
+
+def _copy_member(
+    source: zipfile.ZipFile, source_name: str, package: zipfile.ZipFile, name: str
+) -> None:
+    source_info = source.getinfo(source_name)
+    info = zipfile.ZipInfo(name, date_time=source_info.date_time)
+    info.compress_type = source_info.compress_type
+    info.file_size = source_info.file_size
+    with source.open(source_info) as src, package.open(info, "w") as dest:
+        shutil.copyfileobj(src, dest, COPY_BUFFER_SIZE)
+
+
+def _merge_collection(collection_path: Path, source_collection_path: Path) -> None:
+    """Append the decks, models, notes and cards of another collection to a collection."""
+    conn = sqlite3.connect(collection_path)
+    conn.execute("ATTACH DATABASE ? AS source", (str(source_collection_path),))
+
+    (max_id,) = conn.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM notes UNION ALL SELECT id FROM cards)"
+    ).fetchone()
+    (min_source_id,) = conn.execute(
+        "SELECT MIN(id) FROM (SELECT id FROM source.notes UNION ALL SELECT id FROM source.cards)"
+    ).fetchone()
+    offset = max(0, (max_id or 0) + 1 - (min_source_id or 0))
+    conn.execute(
+        "INSERT INTO notes SELECT id + ?, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data "
+        "FROM source.notes",
+        (offset,),
+    )
+    conn.execute(
+        "INSERT INTO cards SELECT id + :offset, nid + :offset, did, ord, mod, usn, type, queue, "
+        "due, ivl, factor, reps, lapses, left, odue, odid, flags, data FROM source.cards",
+        {"offset": offset},
+    )
+
+    decks_json_str, models_json_str = conn.execute("SELECT decks, models FROM col").fetchone()
+    source_decks_json_str, source_models_json_str = conn.execute(
+        "SELECT decks, models FROM source.col"
+    ).fetchone()
+    decks_json = json.loads(decks_json_str) | json.loads(source_decks_json_str)
+    models_json = json.loads(models_json_str) | json.loads(source_models_json_str)
+    conn.execute(
+        "UPDATE col SET decks = ?, models = ?", (json.dumps(decks_json), json.dumps(models_json))
+    )
+
+    conn.commit()
+    conn.execute("DETACH DATABASE source")
+    conn.close()
+
+
+def _get_tail_offset(infos: dict[str, zipfile.ZipInfo]) -> int | None:
+    """
+    Get the offset of the first member after the media files, or None if the media index and the
+    collection are not stored after all media files.
+    """
+    if COLLECTION_NAME not in infos or MEDIA_NAME not in infos:
+        return None
+
+    tail_offset = min(infos[COLLECTION_NAME].header_offset, infos[MEDIA_NAME].header_offset)
+    if any(
+        info.header_offset > tail_offset
+        for name, info in infos.items()
+        if name not in (COLLECTION_NAME, MEDIA_NAME)
+    ):
+        return None
+    return tail_offset
+
+
+def _drop_members_from(package: zipfile.ZipFile, offset: int) -> None:
+    """
+    Forget every member stored at or after `offset`, so that new members overwrite them.
+    zipfile has no public API to remove members, so this rewrites the private attributes listed in
+    ZIPFILE_INTERNALS, which `update_package` checks for before patching a package. When appending,
+    ZipFile writes new members from `start_dir` and the central directory from `filelist`.
+    """
+    package.filelist = [info for info in package.filelist if info.header_offset < offset]
+    package.NameToInfo = {info.filename: info for info in package.filelist}
+    package.start_dir = offset
+
+
+def _update_collection(
+    cursor: sqlite3.Cursor, decks: list[genanki.Deck], timestamp: float
+) -> tuple[int, int, int]:
+    """
+    Bring an existing collection in line with `decks`.
+    Returns the number of inserted, updated and deleted notes.
+    """
+    _update_decks_and_models(cursor, decks, timestamp)
+
+    (max_id,) = cursor.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM notes UNION ALL SELECT id FROM cards)"
+    ).fetchone()
+    id_gen = itertools.count(max(int(timestamp * 1000), (max_id or 0) + 1))
+
+    # GUIDs are not guaranteed to be unique (e.g. the same word twice in one template), so notes
+    # sharing a GUID are matched up in insertion order
+    existing_notes: dict[str, deque[tuple[int, int, str, str]]] = {}
+    for note_id, guid, model_id, fields, tags in cursor.execute(
+        "SELECT id, guid, mid, flds, tags FROM notes ORDER BY id"
+    ):
+        existing_notes.setdefault(guid, deque()).append((note_id, model_id, fields, tags))
+
+    inserted = 0
+    updated = 0
+    for deck, note in _iter_notes(decks):
+        if not existing_notes.get(note.guid):
+            note.write_to_db(cursor, timestamp, deck.deck_id, id_gen)
+            inserted += 1
+            continue
+
+        note_id, model_id, fields, tags = existing_notes[note.guid].popleft()
+        new_fields = "\x1f".join(note.fields)
+        new_tags = " " + " ".join(note.tags) + " "
+        if (model_id, fields, tags) != (note.model.model_id, new_fields, new_tags):
+            cursor.execute(
+                "UPDATE notes SET mid = ?, mod = ?, usn = -1, tags = ?, flds = ?, sfld = ? "
+                "WHERE id = ?",
+                (
+                    note.model.model_id,
+                    int(timestamp),
+                    new_tags,
+                    new_fields,
+                    note.sort_field,
+                    note_id,
+                ),
+            )
+            updated += 1
+        for card in note.cards:
+            cursor.execute(
+                "UPDATE cards SET did = ?, due = ?, mod = ?, usn = -1 "
+                "WHERE nid = ? AND ord = ? AND (did != ? OR due != ?)",
+                (deck.deck_id, note.due, int(timestamp), note_id, card.ord, deck.deck_id, note.due),
+            )
+
+    deleted_note_ids = [(note_id,) for notes in existing_notes.values() for note_id, *_ in notes]
+    cursor.executemany("DELETE FROM cards WHERE nid = ?", deleted_note_ids)
+    cursor.executemany("DELETE FROM notes WHERE id = ?", deleted_note_ids)
+
+    return inserted, updated, len(deleted_note_ids)
+
+
+def _update_decks_and_models(
+    cursor: sqlite3.Cursor, decks: list[genanki.Deck], timestamp: float
+) -> None:
+    (decks_json_str,) = cursor.execute("SELECT decks FROM col").fetchone()
+    # Keep Anki's default deck, replace everything else
+    decks_json: dict[str, Any] = {
+        deck_id: deck for deck_id, deck in json.loads(decks_json_str).items() if deck_id == "1"
+    }
+    models_json: dict[str, Any] = {}
+    for deck in decks:
+        decks_json[str(deck.deck_id)] = deck.to_json()
+        for note in deck.notes:
+            deck.add_model(note.model)
+        models_json.update(
+            {
+                str(model.model_id): model.to_json(timestamp, deck.deck_id)
+                for model in deck.models.values()
+            }
+        )
+    cursor.execute(
+        "UPDATE col SET decks = ?, models = ?", (json.dumps(decks_json), json.dumps(models_json))
+    )
+
+
+def _iter_notes(decks: list[genanki.Deck]) -> Iterator[tuple[genanki.Deck, genanki.Note]]:
+    for deck in decks:
+        for note in deck.notes:
+            yield deck, note
+
+
+def _diff_media(
+    infos: dict[str, zipfile.ZipInfo],
+    previous_media: dict[str, str],
+    media_files: dict[str, Path],
+) -> tuple[dict[str, str], list[tuple[str, Path]]]:
+    """
+    Match media files against the ones already stored in the package.
+    Returns the new media index and the media files which still need to be written.
+    """
+    previous_idx_by_name = {name: idx for idx, name in previous_media.items()}
+    next_idx = max((int(name) + 1 for name in infos if name.isdigit()), default=0)
+
+    media_json = {}
+    new_media = []
+    for name, file in media_files.items():
+        idx = previous_idx_by_name.get(name)
+        if idx is None or idx not in infos or not _is_same_file(infos[idx], file):
+            idx = str(next_idx)
+            next_idx += 1
+            new_media.append((idx, file))
+        media_json[idx] = name
+    return media_json, new_media
+
+
+def _get_unreferenced_media_size(
+    infos: dict[str, zipfile.ZipInfo],
+    media_json: dict[str, str],
+    new_media: list[tuple[str, Path]],
+) -> tuple[int, int]:
+    """
+    Get the size of the media files stored in the package which are no longer referenced by
+    `media_json`, along with the size of all media files once the new ones are added.
+    """
+    stored_sizes = {name: info.compress_size for name, info in infos.items() if name.isdigit()}
+    unreferenced_size = sum(size for name, size in stored_sizes.items() if name not in media_json)
+    new_size = sum(file.stat().st_size for _, file in new_media)
+    return unreferenced_size, sum(stored_sizes.values()) + new_size
+
+
+def _is_same_file(info: zipfile.ZipInfo, file: Path) -> bool:
+    if info.file_size != file.stat().st_size:
+        return False
+
+    crc = 0
+    with file.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            crc = zlib.crc32(chunk, crc)
+    return crc == info.CRC
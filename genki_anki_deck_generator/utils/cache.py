@@ -0,0 +1,78 @@
+import sqlite3
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Self
+
+
+class DiskCache:
+    """
+    Size-bounded key/value cache stored in a SQLite database.
+    When the total size of the stored values exceeds `max_size` bytes, the least recently used
+    entries are evicted on close.
+    """
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Access times are only written on close, so that reads never take the database write lock
+        self._accessed: dict[str, float] = {}
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL"
+            ")"
+        )
+
+    def get(self, key: str) -> bytes | None:
+        row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._accessed[key] = time.time()
+        return row[0]  # type: ignore[no-any-return]
+
+    def set(self, key: str, value: bytes) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+
+    def evict(self) -> None:
+        """Evict the least recently used entries until the cache fits in `max_size`."""
+        (total_size,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total_size <= self.max_size:
+            return
+
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total_size <= self.max_size:
+                break
+            to_delete.append((key,))
+            total_size -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+    def close(self) -> None:
+        self._conn.executemany(
+            "UPDATE entries SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._accessed.items()],
+        )
+        self.evict()
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
@@ -1,33 +1,140 @@
-from typing import TypedDict
+import json
+import os
+from collections.abc import Iterable
+from importlib.metadata import version
+from typing import NotRequired, TypedDict
 
 from japanese_verb_conjugator_v2 import VerbClass, generate_japanese_verb_by_str
 
+from genki_anki_deck_generator.config import CACHE_DIR
 from genki_anki_deck_generator.template import Card, VerbGroup
+from genki_anki_deck_generator.utils.profiling import span
+
+CONJUGATION_CACHE_PATH = CACHE_DIR / "conjugations.json"
 
 
 class ConjugationDict(TypedDict):
     polite: str
     past: str
     negative: str
-    # TODO: Add more conjugations as needed
+    te: str
+    potential: str
+    volitional: str
+    passive: str
+    causative: str
+
+
+class ConjugationLinkDict(TypedDict):
+    polite: NotRequired[str]
+    past: NotRequired[str]
+    negative: NotRequired[str]
+    te: NotRequired[str]
+    potential: NotRequired[str]
+    volitional: NotRequired[str]
+    passive: NotRequired[str]
+    causative: NotRequired[str]
+
+
+# Conjugations by "<verb group>:<dictionary form>", None for verbs which could not be conjugated
+_CONJUGATIONS: dict[str, ConjugationDict | None] | None = None
 
 
 def get_conjugations(card: Card) -> ConjugationDict | None:
     if card.verb_group is None:
         return None
 
-    verb_class = _get_verb_class(card)
-    japanese = card.kanji if card.kanji else card.japanese
+    return get_conjugations_batch([card])[_get_cache_key(card)]
+
+
+@span("conjugate")
+def get_conjugations_batch(cards: Iterable[Card]) -> dict[str, ConjugationDict | None]:
+    """
+    Conjugate every distinct verb among `cards` at once.
+    Conjugations are memoized by dictionary form and verb class, both in memory and in a
+    persistent cache, so verbs shared between lessons and decks are only conjugated once.
+    Returns the conjugations by cache key for every verb card.
+    """
+    global _CONJUGATIONS
+    if _CONJUGATIONS is None:
+        _CONJUGATIONS = _load_conjugation_cache()
+
+    conjugations: dict[str, ConjugationDict | None] = {}
+    computed = False
+    for card in cards:
+        if card.verb_group is None:
+            continue
+        key = _get_cache_key(card)
+        if key not in _CONJUGATIONS:
+            _CONJUGATIONS[key] = _conjugate(card.kanji or card.japanese, _get_verb_class(card))
+            computed = True
+        conjugations[key] = _CONJUGATIONS[key]
+
+    if computed:
+        _save_conjugation_cache(_CONJUGATIONS)
+    return conjugations
+
+
+def _conjugate(japanese: str, verb_class: VerbClass) -> ConjugationDict | None:
     try:
         plain = generate_japanese_verb_by_str(japanese, verb_class, "pla")
         polite = generate_japanese_verb_by_str(plain, verb_class, "pol")
         past = generate_japanese_verb_by_str(plain, verb_class, "pla", "past")
         negative = generate_japanese_verb_by_str(plain, verb_class, "pla", "neg")
+        te = generate_japanese_verb_by_str(plain, verb_class, "te")
+        potential = generate_japanese_verb_by_str(plain, verb_class, "pot")
+        volitional = generate_japanese_verb_by_str(plain, verb_class, "vol")
+        passive = generate_japanese_verb_by_str(plain, verb_class, "pass")
+        causative = generate_japanese_verb_by_str(plain, verb_class, "caus")
     except Exception as e:
         print(f"Error generating conjugations for {japanese}: {e}")
         return None
 
-    return ConjugationDict(polite=polite, past=past, negative=negative)
+    return ConjugationDict(
+        polite=polite,
+        past=past,
+        negative=negative,
+        te=te,
+        potential=potential,
+        volitional=volitional,
+        passive=passive,
+        causative=causative,
+    )
+
+
+def _load_conjugation_cache() -> dict[str, ConjugationDict | None]:
+    """Load the persistent cache, treating a missing, outdated or unreadable cache as empty."""
+    try:
+        cache = json.loads(CONJUGATION_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != _get_cache_version():
+        return {}
+    return cache.get("conjugations", {})  # type: ignore[no-any-return]
+
+
+def _save_conjugation_cache(conjugations: dict[str, ConjugationDict | None]) -> None:
+    # Other processes (e.g. generate --split-decks workers) may have saved conjugations since this
+    # one loaded the cache, so merge them in. Each process writes its own temporary file, and the
+    # cache is replaced atomically so that it is never read half-written.
+    merged = _load_conjugation_cache() | conjugations
+    CONJUGATION_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CONJUGATION_CACHE_PATH.with_name(f"{CONJUGATION_CACHE_PATH.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(
+        json.dumps({"version": _get_cache_version(), "conjugations": merged}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    tmp_path.replace(CONJUGATION_CACHE_PATH)
+
+
+def _get_cache_version() -> str:
+    """Conjugations need to be recomputed whenever the conjugator or the list of forms changes."""
+    forms = ",".join(ConjugationDict.__annotations__)
+    return f"{version('japanese-verb-conjugator-v2')}:{forms}"
+
+
+def _get_cache_key(card: Card) -> str:
+    assert card.verb_group is not None, "Card must be a verb"
+    return f"{card.verb_group.value}:{card.kanji or card.japanese}"
 
 
 def _get_verb_class(card: Card) -> VerbClass:
@@ -46,11 +153,16 @@ def get_conjugation_display_names() -> ConjugationDict:
         polite="〜ます",
         past="Past",
         negative="Negative",
+        te="〜て",
+        potential="Potential",
+        volitional="Volitional",
+        passive="Passive",
+        causative="Causative",
     )
 
 
-def get_conjugation_links() -> ConjugationDict:
-    return ConjugationDict(
+def get_conjugation_links() -> ConjugationLinkDict:
+    return ConjugationLinkDict(
         polite="https://jpdb.io/conjugation/verb/%E3%81%BE%E3%81%99",
         past="https://jpdb.io/conjugation/verb/%E3%81%9F",
         negative="https://jpdb.io/conjugation/verb/%E3%81%AA%E3%81%84",
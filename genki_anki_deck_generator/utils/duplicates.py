@@ -1,20 +1,51 @@
+import json
 import logging
+import unicodedata
+from pathlib import Path
+from typing import Any
+
+import jaconv
 
 from genki_anki_deck_generator.template import Card, Template, save_template
+from genki_anki_deck_generator.utils.profiling import span
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_reading(text: str) -> str:
+    """
+    Normalize Japanese text for comparisons: full-width and half-width characters are unified,
+    katakana is converted to hiragana and whitespace is removed.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return "".join(jaconv.kata2hira(text).split())
+
+
+def get_normalized_word(card: Card) -> tuple[str, str | None]:
+    return (
+        normalize_reading(card.japanese),
+        normalize_reading(card.kanji) if card.kanji else None,
+    )
+
+
+@span("find_duplicates")
 def find_duplicates(
     templates_by_deck: dict[str, list[Template]],
     allow_different_meanings: bool = True,
     echo: bool = False,
+    normalize: bool = True,
 ) -> list[list[Card]]:
-    cards_by_word: dict[tuple[str, str | None], list[tuple[Template, Card]]] = {}
+    """
+    Find the groups of cards with the same japanese and kanji.
+    Unless `normalize` is False, words are compared after normalizing them, so that katakana and
+    hiragana, full-width and half-width characters, or words with different whitespace match.
+    """
+    cards_by_word: dict[tuple[str, str | None], list[Card]] = {}
     for templates in templates_by_deck.values():
         for template in templates:
             for card in template.iter_cards():
-                cards_by_word.setdefault((card.japanese, card.kanji), []).append((template, card))
+                word = get_normalized_word(card) if normalize else (card.japanese, card.kanji)
+                cards_by_word.setdefault(word, []).append(card)
 
     duplicates: list[list[Card]] = []
     for card_list in cards_by_word.values():
@@ -22,34 +53,41 @@ def find_duplicates(
             continue
 
         if allow_different_meanings:
-            english = set(card.english for _, card in card_list)
+            english = set(
+                " ".join(card.english.split()).casefold() if normalize else card.english
+                for card in card_list
+            )
             if len(english) > 1:
                 logger.info("Skipping duplicate cards with different English translations:")
                 if echo:
                     print("Skipping duplicate cards with different English translations:")
-                for template, card in card_list:
+                for card in card_list:
                     japanese = f"{card.japanese} / {card.kanji}" if card.kanji else card.japanese
-                    logger.info(f"{template.path}: {japanese} - {card.english}")
+                    logger.info(f"{card.template.path}: {japanese} - {card.english}")
                     if echo:
-                        print(f"  {template.path}: {japanese} - {card.english}")
+                        print(f"  {card.template.path}: {japanese} - {card.english}")
                 continue
 
-        duplicates.append([card for _, card in card_list])
+        duplicates.append(card_list)
 
     return duplicates
 
 
+@span("remove_duplicates")
 def remove_duplicates(
     templates_by_deck: dict[str, list[Template]],
     allow_different_meanings: bool = True,
     save: bool = False,
     echo: bool = True,
-) -> None:
+    normalize: bool = True,
+) -> list[list[Card]]:
     """
-    Check for duplicate vocabulary words in the decks.
-    If `remove` is True, automatically remove duplicates.
+    Remove duplicate vocabulary words from the decks, keeping the preferred card of each group.
+    If `save` is True, save the modified templates. Returns the groups of duplicates.
     """
-    duplicates = find_duplicates(templates_by_deck, allow_different_meanings, echo=echo)
+    duplicates = find_duplicates(
+        templates_by_deck, allow_different_meanings, echo=echo, normalize=normalize
+    )
     duplicate_count = sum(len(dup) - 1 for dup in duplicates)
     if duplicate_count > 0:
         logger.info(f"Total duplicate cards found: {duplicate_count}")
@@ -60,13 +98,13 @@ def remove_duplicates(
         if echo:
             print("No duplicate cards found.")
 
+    # Remove the duplicates of each template at once
+    cards_to_remove: dict[int, tuple[Template, list[Card]]] = {}
     for duplicate_list in duplicates:
-        preferred_card = next(
-            (card for card in duplicate_list if card.sound_file), duplicate_list[0]
-        )
+        preferred_card = get_preferred_card(duplicate_list)
 
         for card in duplicate_list:
-            if card == preferred_card:
+            if card is preferred_card:
                 continue
 
             logger.info(
@@ -76,9 +114,64 @@ def remove_duplicates(
                 print(
                     f"Duplicate card found in {card.template.path}: {card.japanese} - {card.english}"
                 )
-            card.template.remove_card(card)
-            if save:
-                save_template(card.template)
-                logger.info(f"Removed duplicate card: {card.japanese} from {card.template.path}")
+            cards_to_remove.setdefault(id(card.template), (card.template, []))[1].append(card)
+
+    for template, cards in cards_to_remove.values():
+        template.remove_cards(cards)
+        if save:
+            save_template(template)
+            for card in cards:
+                logger.info(f"Removed duplicate card: {card.japanese} from {template.path}")
                 if echo:
-                    print(f"Removed duplicate card: {card.japanese} from {card.template.path}")
+                    print(f"Removed duplicate card: {card.japanese} from {template.path}")
+
+    return duplicates
+
+
+def get_preferred_card(duplicate_list: list[Card]) -> Card:
+    """Get the card kept out of a group of duplicates: the first one with a sound file."""
+    return next((card for card in duplicate_list if card.sound_file), duplicate_list[0])
+
+
+def write_duplicate_report(
+    templates_by_deck: dict[str, list[Template]], duplicates: list[list[Card]], path: Path
+) -> None:
+    """Write the groups of duplicates as JSON, flagging the groups spanning several decks."""
+    deck_by_template = {
+        id(template): deck
+        for deck, templates in templates_by_deck.items()
+        for template in templates
+    }
+    groups: list[dict[str, Any]] = []
+    for duplicate_list in duplicates:
+        preferred_card = get_preferred_card(duplicate_list)
+        decks = list(dict.fromkeys(deck_by_template[id(card.template)] for card in duplicate_list))
+        japanese, kanji = get_normalized_word(duplicate_list[0])
+        groups.append(
+            {
+                "japanese": japanese,
+                "kanji": kanji,
+                "decks": decks,
+                "cross_deck": len(decks) > 1,
+                "cards": [
+                    {
+                        "deck": deck_by_template[id(card.template)],
+                        "template": card.template.path.as_posix(),
+                        "japanese": card.japanese,
+                        "kanji": card.kanji,
+                        "english": card.english,
+                        "sound_file": card.sound_file,
+                        "kept": card is preferred_card,
+                    }
+                    for card in duplicate_list
+                ],
+            }
+        )
+
+    report = {
+        "duplicate_groups": len(groups),
+        "cross_deck_groups": sum(group["cross_deck"] for group in groups),
+        "duplicate_cards": sum(len(duplicate_list) - 1 for duplicate_list in duplicates),
+        "groups": groups,
+    }
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
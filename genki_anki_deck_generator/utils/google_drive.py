@@ -3,7 +3,10 @@ from pathlib import Path
 
 import gdown
 
+from genki_anki_deck_generator.utils.profiling import span
 
+
+@span("google_drive_download")
 def google_drive_download(file_id: str, destination: Path, unzip: bool = False) -> None:
     """Download a file from Google Drive."""
     if not unzip:
@@ -15,7 +18,7 @@ def google_drive_download(file_id: str, destination: Path, unzip: bool = False)
     destination.mkdir(parents=True, exist_ok=True)
     zip_destination = destination / f"{destination.stem}.zip"
     gdown.download(id=file_id, output=str(zip_destination))
-    with zipfile.ZipFile(zip_destination, "r") as zip_ref:
+    with span("unzip"), zipfile.ZipFile(zip_destination, "r") as zip_ref:
         zip_ref.extractall(destination)
     print(f"Unzipped {zip_destination} to {destination}")
     zip_destination.unlink()
@@ -1,12 +1,53 @@
+import hashlib
+from collections.abc import Sequence
+from functools import cache
 from pathlib import Path
 from typing import Any
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from genki_anki_deck_generator.config import CACHE_DIR
 
 TEMPLATES_DIR = Path("templates")
-ENV = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=False)
+BYTECODE_CACHE_DIR = CACHE_DIR / "jinja"
+
+
+@cache
+def get_environment() -> Environment:
+    """
+    Get the Jinja environment used to render card templates.
+    Compiled templates are persisted to a bytecode cache, which Jinja invalidates whenever the
+    checksum of a template's source changes.
+    """
+    BYTECODE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        autoescape=False,
+        bytecode_cache=FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR)),
+        auto_reload=False,
+    )
+
+
+@cache
+def get_template(template_path: Path) -> Template:
+    return get_environment().get_template(template_path.as_posix())
 
 
 def render_template(template_path: Path, context: dict[str, Any]) -> str:
-    template = ENV.get_template(template_path.as_posix())
-    return template.render(context)
+    return get_template(template_path).render(context)
+
+
+def render_templates(template_paths: Sequence[Path], context: dict[str, Any]) -> list[str]:
+    """Render several templates from the same context, e.g. all sides of a card."""
+    return [get_template(template_path).render(context) for template_path in template_paths]
+
+
+@cache
+def get_templates_digest() -> str:
+    """Hash the names and contents of every file under the templates directory."""
+    digest = hashlib.sha256()
+    for path in sorted(TEMPLATES_DIR.rglob("*")):
+        if path.is_file():
+            digest.update(path.relative_to(TEMPLATES_DIR).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
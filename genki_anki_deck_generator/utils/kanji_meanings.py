@@ -1,13 +1,58 @@
 import json
+import mmap
+import struct
 from pathlib import Path
-from typing import Any
 
 import requests
 
 from genki_anki_deck_generator.config import get_config
+from genki_anki_deck_generator.utils.profiling import span
 
-KANJI_DATA_PATH = Path("kanji-wanikani.json")
-_KANJI_DATA: dict[str, Any] | None = None
+KANJI_DATA_URL = (
+    "https://raw.githubusercontent.com/davidluzgouveia/kanji-data/master/kanji-wanikani.json"
+)
+KANJI_DATA_PATH = Path("kanji-meanings.bin")
+# Full WaniKani JSON written by previous versions of the download command
+LEGACY_KANJI_DATA_PATH = Path("kanji-wanikani.json")
+
+# The compact kanji data file is laid out as:
+# - a header with a magic number and the number of kanji
+# - an index of (code point, data offset, data length) entries sorted by code point
+# - the meanings of every kanji, UTF-8 encoded and separated by MEANING_SEPARATOR
+MAGIC = b"GKM1"
+HEADER = struct.Struct("<4sI")
+INDEX_ENTRY = struct.Struct("<III")
+MEANING_SEPARATOR = "\x1f"
+
+
+class KanjiMeaningStore:
+    """Memory-mapped compact kanji data file, looking up kanji with a binary search on its index."""
+
+    def __init__(self, path: Path) -> None:
+        with path.open("rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Invalid kanji data file at {path}, run the download command again")
+
+    def get(self, kanji: str) -> list[str] | None:
+        code_point = ord(kanji)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_code_point, offset, length = INDEX_ENTRY.unpack_from(
+                self._data, HEADER.size + middle * INDEX_ENTRY.size
+            )
+            if entry_code_point < code_point:
+                low = middle + 1
+            elif entry_code_point > code_point:
+                high = middle
+            else:
+                return self._data[offset : offset + length].decode("utf-8").split(MEANING_SEPARATOR)
+        return None
+
+
+_KANJI_DATA: KanjiMeaningStore | None = None
 
 
 def get_kanji_meanings(kanji: str) -> list[str] | None:
@@ -20,23 +65,49 @@ def get_kanji_meanings(kanji: str) -> list[str] | None:
         config = get_config()
         kanji_data_path = config.download_dir / KANJI_DATA_PATH
         if not kanji_data_path.exists():
-            raise FileNotFoundError(f"Kanji data file not found at {kanji_data_path}")
+            legacy_kanji_data_path = config.download_dir / LEGACY_KANJI_DATA_PATH
+            if not legacy_kanji_data_path.exists():
+                raise FileNotFoundError(f"Kanji data file not found at {kanji_data_path}")
+            with legacy_kanji_data_path.open("r", encoding="utf-8") as f:
+                write_kanji_data(_get_meanings(json.load(f)), kanji_data_path)
 
-        with kanji_data_path.open("r", encoding="utf-8") as f:
-            _KANJI_DATA = json.load(f)
+        with span("load_kanji_data"):
+            _KANJI_DATA = KanjiMeaningStore(kanji_data_path)
 
-    return _KANJI_DATA.get(kanji, {}).get("wk_meanings")  # type: ignore
+    return _KANJI_DATA.get(kanji)
 
 
+@span("download_kanji_data")
 def download_kanji_data(overwrite: bool = False) -> None:
     config = get_config()
     kanji_data_path = config.download_dir / KANJI_DATA_PATH
     if not kanji_data_path.exists() or overwrite:
-        answer = requests.get(
-            "https://raw.githubusercontent.com/davidluzgouveia/kanji-data/master/kanji-wanikani.json"
-        )
-        parsed = json.loads(answer.text)
-        with kanji_data_path.open("w", encoding="utf-8") as f:
-            json.dump(parsed, f, ensure_ascii=False, indent=2)
+        answer = requests.get(KANJI_DATA_URL)
+        write_kanji_data(_get_meanings(json.loads(answer.text)), kanji_data_path)
     else:
         print(f"Skipping download of kanji data, already exists at {kanji_data_path}")
+
+
+def write_kanji_data(meanings: dict[str, list[str]], path: Path) -> None:
+    """Compile the meanings of each kanji into the compact kanji data file."""
+    index = bytearray()
+    data = bytearray()
+    data_offset = HEADER.size + len(meanings) * INDEX_ENTRY.size
+    for kanji in sorted(meanings, key=ord):
+        encoded = MEANING_SEPARATOR.join(meanings[kanji]).encode("utf-8")
+        index += INDEX_ENTRY.pack(ord(kanji), data_offset + len(data), len(encoded))
+        data += encoded
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_bytes(HEADER.pack(MAGIC, len(meanings)) + index + data)
+    tmp_path.replace(path)
+
+
+def _get_meanings(wanikani_data: dict[str, dict[str, object]]) -> dict[str, list[str]]:
+    """Keep only the WaniKani meanings of the kanji which have some."""
+    return {
+        kanji: meanings
+        for kanji, fields in wanikani_data.items()
+        if isinstance(meanings := fields.get("wk_meanings"), list) and meanings
+    }
@@ -0,0 +1,123 @@
+import hashlib
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+
+from genki_anki_deck_generator.config import CACHE_DIR
+from genki_anki_deck_generator.utils.profiling import span
+
+MEDIA_CACHE_DIR = CACHE_DIR / "media"
+AUDIO_SUFFIXES = (".mp3", ".wav")
+TRANSCODED_SUFFIX = ".mp3"
+
+# Trim the leading and trailing silence, then normalize the loudness of every clip to the same
+# level. Mono 64 kbit/s mp3 is plenty for short speech clips and plays on every Anki client.
+TRANSCODE_FILTER = (
+    "silenceremove=start_periods=1:start_threshold=-50dB,areverse,"
+    "silenceremove=start_periods=1:start_threshold=-50dB,areverse,"
+    "loudnorm=I=-16:TP=-1.5:LRA=11"
+)
+TRANSCODE_OPTIONS = ("-ac", "1", "-ar", "44100", "-codec:a", "libmp3lame", "-b:a", "64k")
+
+
+def is_transcoding_available() -> bool:
+    return shutil.which(AudioSegment.converter) is not None
+
+
+def get_transcoded_name(name: str) -> str:
+    """Media name of a file after transcoding, only audio files are renamed."""
+    if not _is_audio(name):
+        return name
+    return str(PurePosixPath(name).with_suffix(TRANSCODED_SUFFIX))
+
+
+def _is_audio(name: str) -> bool:
+    return PurePosixPath(name).suffix.lower() in AUDIO_SUFFIXES
+
+
+@span("transcode_media")
+def transcode_media_files(media_files: dict[str, Path], jobs: int = 1) -> dict[str, Path]:
+    """
+    Transcode the audio files among `media_files` to trimmed, loudness-normalized mp3s.
+    Transcoded files are cached in MEDIA_CACHE_DIR, keyed by the hash of the source file and
+    of the transcoding settings, so each file is only transcoded once.
+    Returns the media files by their transcoded names, other media files are kept as they are.
+    """
+    transcoded: dict[str, Path] = {}
+    # Source files by transcoded file, identical sources are only transcoded once
+    to_transcode: dict[Path, Path] = {}
+    source_size = 0
+    cached_count = 0
+    for name, file in media_files.items():
+        if not _is_audio(name):
+            transcoded[name] = file
+            continue
+
+        transcoded_name = get_transcoded_name(name)
+        if transcoded_name in media_files and transcoded_name != name:
+            raise ValueError(f"Media files {name} and {transcoded_name} conflict once transcoded")
+        target = MEDIA_CACHE_DIR / f"{_get_transcode_key(file)}{TRANSCODED_SUFFIX}"
+        if target.exists():
+            cached_count += 1
+        else:
+            to_transcode[target] = file
+        transcoded[transcoded_name] = target
+        source_size += file.stat().st_size
+
+    if to_transcode:
+        MEDIA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # The work is done by ffmpeg, so threads are enough to run several transcodes at once
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(_transcode, to_transcode.values(), to_transcode.keys()))
+
+    transcoded_size = sum(
+        file.stat().st_size for name, file in transcoded.items() if _is_audio(name)
+    )
+    print(
+        f"Transcoded {len(to_transcode)} audio files ({cached_count} cached), "
+        f"{source_size / 1024**2:.1f} MB -> {transcoded_size / 1024**2:.1f} MB"
+    )
+    return transcoded
+
+
+def _get_transcode_key(file: Path) -> str:
+    settings = "\0".join((TRANSCODE_FILTER, *TRANSCODE_OPTIONS))
+    with file.open("rb") as f:
+        digest = hashlib.file_digest(f, "sha256")
+    digest.update(settings.encode())
+    return digest.hexdigest()
+
+
+def _transcode(file: Path, target: Path) -> None:
+    # Split deck workers may transcode the same file at once, so each needs its own temporary file
+    with tempfile.NamedTemporaryFile(
+        dir=target.parent, prefix=f"{target.stem}.", suffix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_path = Path(tmp_file.name)
+    command = [
+        AudioSegment.converter,
+        "-y",
+        "-i",
+        str(file),
+        "-af",
+        TRANSCODE_FILTER,
+        *TRANSCODE_OPTIONS,
+        "-f",
+        "mp3",
+        str(tmp_path),
+    ]
+    process = subprocess.run(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False
+    )
+    if process.returncode != 0:
+        tmp_path.unlink(missing_ok=True)
+        raise CouldntEncodeError(
+            f"Transcoding {file} failed. ffmpeg returned error code: {process.returncode}\n\n"
+            f"Command:{command}\n\nOutput from ffmpeg:\n{process.stderr.decode(errors='replace')}"
+        )
+    tmp_path.replace(target)
@@ -0,0 +1,106 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(kw_only=True)
+class Span:
+    name: str
+    start: float
+    end: float
+    pid: int
+    tid: int
+
+
+# Spans recorded in this process, or None if profiling is disabled
+_SPANS: list[Span] | None = None
+
+
+@contextmanager
+def span(name: str) -> Generator[None, None, None]:
+    """Record the time spent in a pipeline phase. Does nothing unless profiling is enabled."""
+    if _SPANS is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _SPANS.append(
+            Span(
+                name=name,
+                start=start,
+                end=time.perf_counter(),
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+            )
+        )
+
+
+@contextmanager
+def profile(
+    enabled: bool, trace_path: Path | None = None, stats_path: Path | None = None
+) -> Generator[None, None, None]:
+    """
+    Record spans while running the body, then print a summary of the time spent in each phase.
+    Optionally writes the spans as a Chrome trace and a cProfile of the whole run.
+    Spans recorded in worker processes are not collected.
+    """
+    global _SPANS
+    if not enabled:
+        yield
+        return
+
+    _SPANS = []
+    profiler = cProfile.Profile()
+    if stats_path:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if stats_path:
+            profiler.disable()
+            profiler.dump_stats(stats_path)
+            print(f"Wrote cProfile stats to {stats_path}")
+        spans, _SPANS = _SPANS, None
+        print_summary(spans)
+        if trace_path:
+            write_chrome_trace(spans, trace_path)
+            print(f"Wrote Chrome trace to {trace_path}")
+
+
+def print_summary(spans: list[Span]) -> None:
+    totals: dict[str, list[float]] = {}
+    for s in sorted(spans, key=lambda s: s.start):
+        totals.setdefault(s.name, []).append(s.end - s.start)
+
+    print()
+    print(f"{'Phase':<30} {'Calls':>7} {'Total':>10} {'Mean':>10} {'Max':>10}")
+    for name, durations in totals.items():
+        print(
+            f"{name:<30} {len(durations):>7} {sum(durations):>9.3f}s "
+            f"{sum(durations) / len(durations):>9.3f}s {max(durations):>9.3f}s"
+        )
+
+
+def write_chrome_trace(spans: list[Span], path: Path) -> None:
+    """Write spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+    events = [
+        {
+            "name": s.name,
+            "ph": "X",
+            "ts": s.start * 1_000_000,
+            "dur": (s.end - s.start) * 1_000_000,
+            "pid": s.pid,
+            "tid": s.tid,
+        }
+        for s in spans
+    ]
+    path.write_text(json.dumps({"traceEvents": events}), encoding="utf-8")
@@ -1,43 +1,296 @@
+import contextlib
+import hashlib
+import itertools
+import json
+import mmap
+import subprocess
+import tempfile
+from collections.abc import Sequence
 from pathlib import Path
 
+import numpy as np
+import numpy.typing as npt
 from pydub import AudioSegment
-from pydub.silence import split_on_silence
+from pydub.exceptions import CouldntEncodeError
+from pydub.utils import db_to_float, ratio_to_db
 
-from genki_anki_deck_generator.config import DeckAudioFileOverride
+from genki_anki_deck_generator.config import CACHE_DIR, DeckAudioFileOverride
+from genki_anki_deck_generator.utils.profiling import span
+
+PCM_CACHE_DIR = CACHE_DIR / "pcm"
+PCM_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# Decibel values this close to a threshold are recomputed exactly like pydub does, since the
+# vectorized logarithm may round differently in the last bit
+DB_TOLERANCE = 1e-6
+
+# ffmpeg raw PCM formats by sample width, pydub keeps 8-bit samples signed
+PCM_FORMATS = {1: "s8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+
+class Envelope:
+    """
+    Cumulative energy of an audio segment, from which the RMS of any slice is computed in
+    constant time. RMS values are identical to pydub's `AudioSegment.rms` of the same slices.
+    """
+
+    def __init__(self, sound: AudioSegment) -> None:
+        assert sound.sample_width in (1, 2), "Only 8-bit and 16-bit audio is supported"
+        self.length = len(sound)
+        self.frame_rate = sound.frame_rate
+        self.channels = sound.channels
+        self.max_possible_amplitude = sound.max_possible_amplitude
+        samples = np.frombuffer(sound.raw_data, dtype=f"<i{sound.sample_width}")
+        energy = np.square(samples.astype(np.int64)).reshape(-1, self.channels).sum(axis=1)
+        self.cumulative_energy: npt.NDArray[np.int64] = np.concatenate(([0], np.cumsum(energy)))
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.cumulative_energy) - 1
+
+    def rms(
+        self, start_ms: npt.NDArray[np.int64], end_ms: npt.NDArray[np.int64]
+    ) -> npt.NDArray[np.int64]:
+        """RMS of the slices `sound[start_ms:end_ms]`, computed for every start and end at once."""
+        start_ms = np.minimum(start_ms, self.length)
+        end_ms = np.minimum(end_ms, self.length)
+        # Same conversion from milliseconds to frames as AudioSegment.__getitem__
+        start = (start_ms * (self.frame_rate / 1000.0)).astype(np.int64)
+        end = (end_ms * (self.frame_rate / 1000.0)).astype(np.int64)
+        # Slices ending past the last frame are padded with silent frames
+        energy = (
+            self.cumulative_energy[np.clip(end, 0, self.frame_count)]
+            - self.cumulative_energy[np.clip(start, 0, self.frame_count)]
+        )
+        sample_count = np.maximum(end - start, 0) * self.channels
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rms = np.sqrt(energy / sample_count)
+        return np.where(sample_count > 0, rms, 0).astype(np.int64)
 
 
 def _detect_leading_silence(
     sound: AudioSegment, silence_threshold: float = -50.0, chunk_size: int = 10
 ) -> int:
     """
-    sound is a pydub.AudioSegment
-    silence_threshold in dB
-    chunk_size in ms
+    Get the length in ms of the leading silence of a sound, i.e. the start of the first
+    `chunk_size` ms chunk louder than `silence_threshold` dBFS.
+    """
+    assert chunk_size > 0
+    envelope = Envelope(sound)
+    starts = np.arange(0, envelope.length + chunk_size, chunk_size, dtype=np.int64)
+    rms = envelope.rms(starts, starts + chunk_size)
+    with np.errstate(divide="ignore"):
+        db = 20 * np.log10(rms / envelope.max_possible_amplitude)
+    silent = db < silence_threshold
+    for i in np.flatnonzero(np.abs(db - silence_threshold) < DB_TOLERANCE):
+        silent[i] = ratio_to_db(rms[i] / envelope.max_possible_amplitude) < silence_threshold
+    # Chunks past the end of the sound are empty, so the loop always stops there
+    silent[starts >= envelope.length] = False
+
+    return int(starts[np.argmin(silent)])
+
+
+def _detect_silence(
+    envelope: Envelope, min_silence_len: int, silence_thresh: float, seek_step: int = 1
+) -> list[list[int]]:
+    """Vectorized equivalent of `pydub.silence.detect_silence`."""
+    if envelope.length < min_silence_len:
+        return []
+
+    threshold = db_to_float(silence_thresh) * envelope.max_possible_amplitude
+    last_slice_start = envelope.length - min_silence_len
+    slice_starts = np.arange(0, last_slice_start + 1, seek_step, dtype=np.int64)
+    if last_slice_start % seek_step:
+        slice_starts = np.append(slice_starts, last_slice_start)
+
+    silence_starts = slice_starts[
+        envelope.rms(slice_starts, slice_starts + min_silence_len) <= threshold
+    ]
+    if not len(silence_starts):
+        return []
+
+    # Silent slices are combined into ranges, unless separated by a gap
+    previous = silence_starts[:-1]
+    current = silence_starts[1:]
+    breaks = np.flatnonzero(
+        (current != previous + seek_step) & (current > previous + min_silence_len)
+    )
+    range_starts = np.concatenate((silence_starts[:1], current[breaks]))
+    range_ends = np.concatenate((previous[breaks], silence_starts[-1:])) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def _detect_nonsilent(
+    envelope: Envelope, min_silence_len: int, silence_thresh: float
+) -> list[list[int]]:
+    """Equivalent of `pydub.silence.detect_nonsilent`."""
+    silent_ranges = _detect_silence(envelope, min_silence_len, silence_thresh)
+    if not silent_ranges:
+        return [[0, envelope.length]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == envelope.length:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+    if end_i != envelope.length:
+        nonsilent_ranges.append([prev_end_i, envelope.length])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def split_on_silence(
+    sound: AudioSegment,
+    min_silence_len: int,
+    silence_thresh: float,
+    envelope: Envelope | None = None,
+) -> list[AudioSegment]:
+    """
+    Split a sound on silences longer than `min_silence_len` ms, keeping all the silence.
+    Equivalent to `pydub.silence.split_on_silence(..., keep_silence=True)`, with the loudness
+    of every slice computed at once from the envelope of the sound.
+    """
+    keep_silence = len(sound)
+    output_ranges = [
+        [start - keep_silence, end + keep_silence]
+        for start, end in _detect_nonsilent(
+            envelope or Envelope(sound), min_silence_len, silence_thresh
+        )
+    ]
+    for range_i, range_ii in itertools.pairwise(output_ranges):
+        last_end = range_i[1]
+        next_start = range_ii[0]
+        if next_start < last_end:
+            range_i[1] = (last_end + next_start) // 2
+            range_ii[0] = range_i[1]
+
+    return [sound[max(start, 0) : min(end, len(sound))] for start, end in output_ranges]
+
+
+def get_file_digest(file: Path) -> str:
+    with file.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@span("decode_audio")
+def decode_audio(file: Path, use_cache: bool = True) -> tuple[AudioSegment, Envelope]:
+    """
+    Decode an mp3 file along with its loudness envelope.
+    Unless `use_cache` is False, the decoded samples are cached in PCM_CACHE_DIR, keyed by the
+    hash of the file, so that re-splitting a file with other silence thresholds does not decode
+    it again. Cached samples are memory-mapped rather than read into memory.
+    """
+    if not use_cache:
+        sound = AudioSegment.from_mp3(file)
+        return sound, Envelope(sound)
+
+    digest = get_file_digest(file)
+    metadata_path = PCM_CACHE_DIR / f"{digest}.json"
+    samples_path = PCM_CACHE_DIR / f"{digest}.pcm"
+    # Entries may be evicted by another process at any time, in which case the file is decoded
+    with contextlib.suppress(FileNotFoundError):
+        metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+        sound = AudioSegment(
+            _map_file(samples_path),
+            frame_rate=metadata["frame_rate"],
+            sample_width=metadata["sample_width"],
+            channels=metadata["channels"],
+        )
+        # Mark the entry as recently used
+        metadata_path.touch()
+        return sound, Envelope(sound)
+
+    sound = AudioSegment.from_mp3(file)
+    PCM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _write_atomically(samples_path, sound.raw_data)
+    # The metadata is written last, so that the samples are only used once complete
+    metadata = {
+        "frame_rate": sound.frame_rate,
+        "sample_width": sound.sample_width,
+        "channels": sound.channels,
+    }
+    _write_atomically(metadata_path, json.dumps(metadata).encode("utf-8"))
+    _evict_pcm_cache(keep=digest)
+    return sound, Envelope(sound)
 
-    iterate over chunks until you find the first one with sound
+
+def _map_file(path: Path) -> mmap.mmap | bytes:
+    """
+    Memory-map a file read-only. Slicing the map only copies the slice, so AudioSegments built on
+    it read the samples they need from the page cache instead of copying the whole file.
     """
-    trim_ms = 0  # ms
+    if not path.stat().st_size:
+        # Empty files cannot be mapped
+        return b""
+    with path.open("rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _write_atomically(path: Path, data: bytes) -> None:
+    # Workers decoding the same file at once each write their own temporary file
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_file.write(data)
+    Path(tmp_file.name).replace(path)
+
+
+def _evict_pcm_cache(keep: str) -> None:
+    """Evict the least recently used decoded files until PCM_CACHE_DIR fits in PCM_CACHE_MAX_SIZE."""
+    entries: dict[str, list[Path]] = {}
+    sizes: dict[str, int] = {}
+    last_used: dict[str, float] = {}
+    for path in PCM_CACHE_DIR.iterdir():
+        # Temporary files are still being written by other processes
+        if path.suffix == ".tmp":
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # Replaced or evicted by another process in the meantime
+            continue
+        digest = path.name.split(".", 1)[0]
+        entries.setdefault(digest, []).append(path)
+        sizes[digest] = sizes.get(digest, 0) + stat.st_size
+        last_used[digest] = max(last_used.get(digest, 0.0), stat.st_mtime)
 
-    assert chunk_size > 0  # to avoid infinite loop
-    while sound[trim_ms : trim_ms + chunk_size].dBFS < silence_threshold and trim_ms < len(sound):
-        trim_ms += chunk_size
+    total_size = sum(sizes.values())
+    if total_size <= PCM_CACHE_MAX_SIZE:
+        return
 
-    return trim_ms
+    for digest in sorted(entries, key=last_used.__getitem__):
+        if total_size <= PCM_CACHE_MAX_SIZE:
+            break
+        if digest == keep:
+            continue
+        for path in entries[digest]:
+            # Files still mapped by another process cannot be deleted on Windows
+            with contextlib.suppress(OSError):
+                path.unlink()
+        total_size -= sizes[digest]
 
 
 def _split_words(
-    file: Path, sound_silence_threshold: int, overrides: dict[int, DeckAudioFileOverride]
+    file: Path,
+    sound_silence_threshold: int,
+    overrides: dict[int, DeckAudioFileOverride],
+    use_cache: bool = True,
 ) -> list[AudioSegment]:
-    sound_file = AudioSegment.from_mp3(file)
-    audio_chunks: list[AudioSegment] = split_on_silence(
-        sound_file,
-        keep_silence=True,
-        min_silence_len=sound_silence_threshold,
-        silence_thresh=-32,
-    )
-    for i, chunk in enumerate(audio_chunks):
-        start_trim = _detect_leading_silence(chunk)
-        audio_chunks[i] = chunk[start_trim:]
+    sound_file, envelope = decode_audio(file, use_cache)
+    with span("split_on_silence"):
+        audio_chunks = split_on_silence(
+            sound_file,
+            min_silence_len=sound_silence_threshold,
+            silence_thresh=-32,
+            envelope=envelope,
+        )
+    with span("trim_leading_silence"):
+        for i, chunk in enumerate(audio_chunks):
+            start_trim = _detect_leading_silence(chunk)
+            audio_chunks[i] = chunk[start_trim:]
 
     words: list[AudioSegment] = []
     i = 0
@@ -59,7 +312,6 @@ def _split_words(
             )
             sound_parts = split_on_silence(
                 sound,
-                keep_silence=True,
                 min_silence_len=override.resplit,
                 silence_thresh=-32,
             )
@@ -77,18 +329,84 @@ def _split_words(
     return words
 
 
+@span("split_audio_file")
 def split_audio_file(
     file: Path,
     target_dir: Path,
     sound_silence_threshold: int,
     overrides: dict[int, DeckAudioFileOverride],
-) -> None:
+    use_cache: bool = True,
+) -> list[str]:
     """
     Splits the audio file into segments based on silence.
-    Returns a list of AudioSegment objects.
+    Returns the names of the segment files written to `target_dir`.
     """
-    words = _split_words(file, sound_silence_threshold, overrides)
+    words = _split_words(file, sound_silence_threshold, overrides, use_cache)
 
     target_dir.mkdir(parents=True, exist_ok=True)
-    for i, word in enumerate(words):
-        word.export(target_dir / f"{file.stem}_{i}.mp3", format="mp3")
+    segment_names = [f"{file.stem}_{i}.mp3" for i in range(len(words))]
+    with span("export_segments"):
+        export_segments(words, [target_dir / segment_name for segment_name in segment_names])
+    return segment_names
+
+
+def export_segments(segments: Sequence[AudioSegment], paths: Sequence[Path]) -> None:
+    """
+    Encode every segment to the mp3 file at the same position in `paths`, in a single ffmpeg
+    process. The segments are piped as one PCM stream, which ffmpeg splits back into segments
+    by sample offsets, instead of starting ffmpeg once per segment like `AudioSegment.export`.
+    Empty segments are exported on their own, since ffmpeg does not encode empty streams.
+    """
+    assert len(segments) == len(paths)
+    batch = [(segment, path) for segment, path in zip(segments, paths) if segment.frame_count()]
+    for segment, path in zip(segments, paths):
+        if not segment.frame_count():
+            segment.export(path, format="mp3")
+    if not batch:
+        return
+
+    first = batch[0][0]
+    assert all(
+        (segment.frame_rate, segment.sample_width, segment.channels)
+        == (first.frame_rate, first.sample_width, first.channels)
+        for segment, _ in batch
+    ), "Segments must have the same frame rate, sample width and channels"
+
+    filters = [f"[0:a]asplit={len(batch)}" + "".join(f"[in{i}]" for i in range(len(batch)))]
+    outputs: list[str] = []
+    start = 0
+    for i, (segment, path) in enumerate(batch):
+        end = start + int(segment.frame_count())
+        filters.append(
+            f"[in{i}]atrim=start_sample={start}:end_sample={end},asetpts=PTS-STARTPTS[out{i}]"
+        )
+        outputs += ["-map", f"[out{i}]", "-f", "mp3", str(path)]
+        start = end
+
+    command = [
+        AudioSegment.converter,
+        "-y",
+        "-f",
+        PCM_FORMATS[first.sample_width],
+        "-ar",
+        str(first.frame_rate),
+        "-ac",
+        str(first.channels),
+        "-i",
+        "pipe:0",
+        "-filter_complex",
+        ";".join(filters),
+        *outputs,
+    ]
+    process = subprocess.run(
+        command,
+        input=b"".join(segment.raw_data for segment, _ in batch),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+    if process.returncode != 0:
+        raise CouldntEncodeError(
+            f"Encoding failed. ffmpeg returned error code: {process.returncode}\n\n"
+            f"Command:{command}\n\nOutput from ffmpeg:\n{process.stderr.decode(errors='replace')}"
+        )
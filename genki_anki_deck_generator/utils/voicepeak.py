@@ -1,7 +1,10 @@
 import subprocess
 from pathlib import Path
 
+from genki_anki_deck_generator.utils.profiling import span
 
+
+@span("tts")
 def voicepeak_tts(text: str, narrator: str, output_path: Path) -> None:
     command = [
         "voicepeak",
@@ -3,7 +3,10 @@ from pathlib import Path
 
 from voicevox import Client
 
+from genki_anki_deck_generator.utils.profiling import span
 
+
+@span("tts")
 def voicevox_tts(text: str, speaker: int, output_path: Path) -> None:
     asyncio.run(_voicevox_tts(text, speaker, output_path))
 
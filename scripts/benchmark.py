@@ -0,0 +1,281 @@
+"""
+Benchmark the generate pipeline on synthetic decks.
+
+Builds synthetic deck trees laid out like config/decks/<deck>/Lxx/*.yaml, runs each generation
+phase on them and reports the wall time and peak traced memory of every phase as JSON, e.g.:
+
+    uv run python scripts/benchmark.py --cards 1000 10000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Generator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from genki_anki_deck_generator.commands.generate import PACKAGE_PATH, build_decks
+from genki_anki_deck_generator.config import get_config, set_config_path, set_decks_path
+from genki_anki_deck_generator.template import load_templates
+from genki_anki_deck_generator.utils.anki_package import write_package
+from genki_anki_deck_generator.utils.duplicates import remove_duplicates
+from genki_anki_deck_generator.utils.kanji_meanings import KANJI_DATA_PATH, write_kanji_data
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+HIRAGANA = [chr(c) for c in range(ord("あ"), ord("ん") + 1)]
+KANJI = [chr(c) for c in range(0x4E00, 0x4E00 + 2000)]
+VERBS = [
+    ("たべる", "食べる", "ichidan"),
+    ("みる", "見る", "ichidan"),
+    ("のむ", "飲む", "godan"),
+    ("かう", "買う", "godan"),
+    ("まつ", "待つ", "godan"),
+    ("する", None, "irregular"),
+    ("くる", "来る", "irregular"),
+]
+
+
+@dataclass(kw_only=True)
+class CorpusOptions:
+    cards: int
+    decks: int
+    cards_per_file: int
+    kanji_ratio: float
+    verb_ratio: float
+    audio_ratio: float
+    duplicate_ratio: float
+    seed: int
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--cards",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Corpus sizes to benchmark (default: 1000 10000 100000)",
+    )
+    parser.add_argument("--decks", type=int, default=2, help="Number of decks (default: 2)")
+    parser.add_argument(
+        "--cards-per-file", type=int, default=100, help="Cards per template file (default: 100)"
+    )
+    parser.add_argument(
+        "--kanji-ratio", type=float, default=0.6, help="Share of cards with kanji (default: 0.6)"
+    )
+    parser.add_argument(
+        "--verb-ratio", type=float, default=0.15, help="Share of verb cards (default: 0.15)"
+    )
+    parser.add_argument(
+        "--audio-ratio", type=float, default=0.8, help="Share of cards with audio (default: 0.8)"
+    )
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.02,
+        help="Share of cards duplicating an earlier card (default: 0.02)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Worker processes used to parse templates and render cards",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Do not trace memory allocations, which slows down every phase",
+    )
+    parser.add_argument(
+        "--output", "-o", type=Path, default=None, help="Write results to this file (JSON)"
+    )
+    args = parser.parse_args()
+
+    results = []
+    for cards in args.cards:
+        options = CorpusOptions(
+            cards=cards,
+            decks=args.decks,
+            cards_per_file=args.cards_per_file,
+            kanji_ratio=args.kanji_ratio,
+            verb_ratio=args.verb_ratio,
+            audio_ratio=args.audio_ratio,
+            duplicate_ratio=args.duplicate_ratio,
+            seed=args.seed,
+        )
+        print(f"Benchmarking {cards} cards...", file=sys.stderr)
+        # Every corpus runs in a fresh process, so module-level caches and memory from previous
+        # runs do not leak into the results
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_benchmark, options, args.jobs, not args.no_memory).result()
+        for phase, timings in result["phases"].items():
+            print(
+                f"  {phase:<20} {timings['wall_time_s']:>9.3f}s"
+                f" {timings['peak_memory_bytes'] / 1024 / 1024:>9.1f} MiB",
+                file=sys.stderr,
+            )
+        results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+def run_benchmark(options: CorpusOptions, jobs: int, trace_memory: bool) -> dict[str, Any]:
+    phases: dict[str, dict[str, float]] = {}
+
+    @contextmanager
+    def phase(name: str) -> Generator[None, None, None]:
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        phases[name] = {
+            "wall_time_s": time.perf_counter() - start,
+            "peak_memory_bytes": tracemalloc.get_traced_memory()[1] if trace_memory else 0,
+        }
+
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        create_corpus(root, options)
+        os.chdir(root)
+        set_config_path(root / "config" / "config.toml")
+        set_decks_path(root / "config" / "decks")
+
+        if trace_memory:
+            tracemalloc.start()
+        with phase("load_templates"):
+            templates_by_deck = load_templates(use_cache=False, jobs=jobs)
+        with phase("remove_duplicates"):
+            if get_config().dedupe:
+                remove_duplicates(templates_by_deck, echo=False)
+        with phase("build_decks"):
+            anki_decks, media_files = build_decks(templates_by_deck, jobs=jobs, use_cache=False)
+        with phase("write_package"):
+            write_package(anki_decks, media_files, PACKAGE_PATH)
+        tracemalloc.stop()
+
+        os.chdir(cwd)
+
+    return {
+        "options": asdict(options),
+        "jobs": jobs,
+        "notes": sum(len(deck.notes) for deck in anki_decks),
+        "phases": phases,
+        "total_wall_time_s": sum(timings["wall_time_s"] for timings in phases.values()),
+    }
+
+
+def create_corpus(root: Path, options: CorpusOptions) -> None:
+    """Create a synthetic config, deck tree, templates symlink and placeholder media in `root`."""
+    rng = random.Random(options.seed)
+    decks = {f"bench_{i + 1}": f"Bench {i + 1}" for i in range(options.decks)}
+    config_dir = root / "config"
+    config_dir.mkdir()
+    deck_names = ", ".join(f"{deck} = {json.dumps(name)}" for deck, name in decks.items())
+    deck_ids = ", ".join(f"{deck} = {1_000_000_000 + i}" for i, deck in enumerate(decks))
+    (config_dir / "config.toml").write_text(
+        "[settings]\n"
+        f"decks = {{ {deck_names} }}\n"
+        f"deck_ids = {{ {deck_ids} }}\n"
+        'download_dir = "sources"\n'
+        "dedupe = true\n"
+        "\n"
+        "[settings.sources]\n"
+        "audio = {}\n"
+        'fonts = ""\n',
+        encoding="utf-8",
+    )
+    (root / "templates").symlink_to(REPO_DIR / "templates", target_is_directory=True)
+
+    sources_dir = root / "sources"
+    (sources_dir / "fonts").mkdir(parents=True)
+    (sources_dir / "fonts" / "_NotoSansCJKjp-Regular.woff2").write_bytes(b"\0" * 64)
+    write_kanji_data(
+        {kanji: [f"meaning {i}"] for i, kanji in enumerate(KANJI)}, sources_dir / KANJI_DATA_PATH
+    )
+
+    cards: list[dict[str, Any]] = []
+    for i in range(options.cards):
+        if cards and rng.random() < options.duplicate_ratio:
+            cards.append(dict(rng.choice(cards)))
+            continue
+
+        card = _random_card(rng, i, options)
+        if "sound_file" in card:
+            sound_file = sources_dir / "audio" / card["sound_file"]
+            sound_file.parent.mkdir(parents=True, exist_ok=True)
+            sound_file.write_bytes(rng.randbytes(32))
+        cards.append(card)
+
+    cards_per_deck = -(-len(cards) // len(decks))
+    for deck_index, deck in enumerate(decks):
+        deck_dir = config_dir / "decks" / deck
+        deck_dir.mkdir(parents=True)
+        (deck_dir / "audio.yaml").write_text("audio: []\n", encoding="utf-8")
+
+        deck_cards = cards[deck_index * cards_per_deck : (deck_index + 1) * cards_per_deck]
+        for file_index in range(0, len(deck_cards), options.cards_per_file):
+            lesson = file_index // options.cards_per_file
+            template = {
+                "tags": [deck, f"Lesson_{lesson}"],
+                "vocabulary": [
+                    {
+                        "tags": ["Vocabulary"],
+                        "vocabulary": deck_cards[file_index : file_index + options.cards_per_file],
+                    }
+                ],
+            }
+            template_path = deck_dir / f"L{lesson:02d}" / "01_vocabulary.yaml"
+            template_path.parent.mkdir()
+            template_path.write_text(
+                yaml.safe_dump(template, allow_unicode=True, sort_keys=False), encoding="utf-8"
+            )
+
+
+def _random_card(rng: random.Random, i: int, options: CorpusOptions) -> dict[str, Any]:
+    card: dict[str, Any]
+    if rng.random() < options.verb_ratio:
+        japanese, kanji, verb_group = rng.choice(VERBS)
+        card = {"japanese": japanese, "english": f"verb {i}"}
+        if kanji:
+            card["kanji"] = kanji
+        card["verb_group"] = verb_group
+    else:
+        japanese = "".join(rng.choices(HIRAGANA, k=rng.randint(2, 6)))
+        card = {"japanese": japanese, "english": f"word {i}"}
+        if rng.random() < options.kanji_ratio:
+            kanji = "".join(rng.choices(KANJI, k=rng.randint(1, 3)))
+            card["kanji"] = kanji
+            card["kanji_readings"] = [{kanji: japanese}]
+
+    if rng.random() < options.audio_ratio:
+        card["sound_file"] = f"bench/{i // 1000:03d}/{i}.mp3"
+    return card
+
+
+if __name__ == "__main__":
+    main()
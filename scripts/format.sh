@@ -3,7 +3,7 @@
 set -e
 set -x
 
-python_files=(genki_anki_deck_generator)
+python_files=(genki_anki_deck_generator scripts)
 
 uv run ruff check "${python_files[@]}" --fix
 uv run ruff format "${python_files[@]}"
@@ -3,7 +3,7 @@
 set -e
 set -x
 
-python_files=(genki_anki_deck_generator)
+python_files=(genki_anki_deck_generator scripts)
 
 echo "Running ruff check..."
 uv run ruff check "${python_files[@]}"